@@ -1,5 +1,9 @@
 import argparse
 from sonar_src import fetch_organization_sonar_data, fetch_projects_sonar_data
+from sonar_src.route_config import RequestsConfig
+from sonar_src.response_cache import ResponseCache
+from sonar_src.sinks import SinkConfig
+from sonar_src.sonar_issue import IssuesConfig
 from pathlib import Path
 from urllib.parse import unquote
 
@@ -51,12 +55,32 @@ if __name__ == '__main__':
     ap.add_argument("-o", "--organization", default="", help="Sonarqube organization.")
     ap.add_argument("-f", "--file", help="File containing projects' sonarqube links.")
     ap.add_argument("-c", "--component-wise", default=False, action="store_true", help="Whether to fetch issues data for all components of project.")
+    ap.add_argument("-w", "--workers", type=int, default=1, help="Number of projects mined at the same time.")
+    ap.add_argument("--page-workers", type=int, default=1, help="Number of pages, or batches of measure metrics, fetched concurrently once the total number of elements is known.")
+    ap.add_argument("--pool-size", type=int, default=None, help="Number of kept-alive connections per server. Defaults to workers * page workers, at least 10.")
+    ap.add_argument("--rate-limit", type=float, default=10.0, help="Maximum number of requests per second sent to one server. Lowered automatically when the server throttles.")
+    ap.add_argument("--cache-dir", default=None, help="Directory of the on-disk cache of server responses. No cache if not given.")
+    ap.add_argument("--cache-ttl", type=float, default=12, help="Hours a cached response stays valid. Metrics, rules and components catalogs are kept longer.")
+    ap.add_argument("--cache-size", type=int, default=1024, help="Maximum size of the response cache in MB.")
+    ap.add_argument("--output-format", default="csv", choices=sorted(SinkConfig.OUTPUT_FORMATS), help="Format of the output files: CSV staging files, Parquet parts (requires pyarrow) or one SQLite database.")
+    ap.add_argument("--incremental", default=False, action="store_true", help="Fetch only the issues updated since the last run.")
+    ap.add_argument("--reconcile-days", type=float, default=7, help="Days after which an incremental run fetches all issues again.")
+    ap.add_argument("--resume", default=False, action="store_true", help="Resume the last run, skipping the projects and stages it completed.")
     args = vars(ap.parse_args())
 
     output_path = args['output_path']
     server = format_server(args['server'])
     organization = args['organization']
     component_wise = args['component_wise']
+    workers = args['workers']
+
+    pool_size = args['pool_size'] if args['pool_size'] is not None else max(10, workers * args['page_workers'])
+    response_cache = None
+    if args['cache_dir'] is not None:
+        response_cache = ResponseCache(args['cache_dir'], default_ttl=args['cache_ttl'] * 60 * 60, max_bytes=args['cache_size'] * 1024 * 1024)
+    RequestsConfig.configure(page_workers=args['page_workers'], pool_size=pool_size, rate_limit=args['rate_limit'], response_cache=response_cache)
+    SinkConfig.configure(output_format=args['output_format'])
+    IssuesConfig.configure(incremental=args['incremental'], reconcile_days=args['reconcile_days'])
 
     if args["file"] is not None:
         file = args["file"]
@@ -69,10 +93,12 @@ if __name__ == '__main__':
                 str(Path(output_path).joinpath(server_dir_name)),
                 server,
                 projects,
-                component_wise
+                component_wise,
+                workers,
+                resume=args['resume']
             )
 
     else:
         if organization == "":
             organization = "default-organization" if server != SONARCLOUD else "apache"
-        fetch_organization_sonar_data(output_path, organization, server, component_wise)
+        fetch_organization_sonar_data(output_path, organization, server, component_wise, workers, resume=args['resume'])
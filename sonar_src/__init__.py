@@ -1,117 +1,246 @@
-import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 
 from .sonar_project import Projects
-from .sonar_metric import Metrics
 from .sonar_analysis import Analyses
 from .sonar_measure import Measures
 from .sonar_issue import Issues
-from .sonar_rule import Rules
 from .sonar_component_project import ComponentProject
 from .sonar_file import Files
+from .catalog import Catalog
+from .journal import RunJournal, MEASURES_STAGE, ISSUES_STAGE
+from .scheduler import StageScheduler
+from .utils import buffered_output
+
+def fetch_project_analyses(output_path, server, organization, project_key, journal):
+    """(keys, dates) of the new analyses of the project, kept by the journal of a resumed run."""
+    analysis_keys_dates = journal.get_analysis_keys_dates(project_key)
+    if analysis_keys_dates is None:
+        analysis = Analyses(server, organization, output_path, project_key)
+        analysis.process_elements()
+        analysis_keys_dates = analysis.get_analysis_keys_dates()
+        journal.complete_analyses(project_key, analysis_keys_dates)
+    return analysis_keys_dates
+
+def fetch_project_measures(output_path, server, organization, project_key, analysis_keys_dates, server_metrics, journal):
+    if journal.is_complete(project_key, MEASURES_STAGE):
+        return
+    measure = Measures(server, organization, output_path, project_key, project_key, project_key, analysis_keys_dates, server_metrics)
+    measure.process_elements()
+    journal.complete(project_key, MEASURES_STAGE)
+
+def fetch_project_issues(output_path, server, organization, project_key, analysis_keys_dates, rules):
+    issues = Issues(server, organization, output_path, project_key, project_key, project_key, analysis_keys_dates, rules)
+    issues.process_elements()
+    return issues
+
+def fetch_component_issues(output_path, server, organization, project_key, analysis_keys_dates, rules, issues):
+    files = Files(server, project_key).get_files()
+
+    # Issues of files are taken from the project issues, unless some
+    # project queries hit the 10k cap and files have to be queried one by one
+    if issues.is_complete():
+        issues.write_component_issues(files)
+        return
+
+    # Only the files with issues in the capped queries are queried one by one
+    truncated_files = issues.get_truncated_files(files)
+    if truncated_files is None:
+        print("\tWARNING: project issues are incomplete, fetching issues file by file")
+        truncated_files = files
+    else:
+        print(f"\tWARNING: project issues are incomplete, fetching issues of {len(truncated_files)} files one by one")
+        truncated_keys = {file[0] for file in truncated_files}
+        issues.write_component_issues([file for file in files if file[0] not in truncated_keys])
+
+    for file in truncated_files:
+        file_key = file[0]
+        file_name = file[1]
+
+        print(f"\t{file_name} - {file_key}")
+
+        # Measures are the same for all files
+
+        # measure = Measures(server, organization, output_path, project_key, file_key, file_name, analysis_keys_dates, server_metrics)
+        # measure.process_elements()
+
+        issues = Issues(server, organization, output_path, project_key, file_key, file_name, analysis_keys_dates, rules)
+        issues.process_elements()
 
-def fetch_organization_sonar_data(output_path, organization = 'apache', server = "https://sonarcloud.io/", component_wise=False):
+def fetch_project_sonar_data(output_path, server, organization, project_key, server_metrics, rules, component_wise=False, journal=None):
+
+    # Stages completed before a resumed run are skipped
+    journal = RunJournal() if journal is None else journal
+
+    analysis_keys_dates = fetch_project_analyses(output_path, server, organization, project_key, journal)    # (keys, dates) tuple
+    if len(analysis_keys_dates[0]) == 0:
+        return
+    print(f"\t{len(analysis_keys_dates[0])} new analyses")
+
+    fetch_project_measures(output_path, server, organization, project_key, analysis_keys_dates, server_metrics, journal)
+
+    # Issues of the files are written from the project issues, both are one stage
+    if journal.is_complete(project_key, ISSUES_STAGE):
+        print("\tAlready fetched in the resumed run")
+        return
+
+    issues = fetch_project_issues(output_path, server, organization, project_key, analysis_keys_dates, rules)
+    if component_wise:
+        fetch_component_issues(output_path, server, organization, project_key, analysis_keys_dates, rules, issues)
+    journal.complete(project_key, ISSUES_STAGE)
+
+def run_projects(projects, fetch_project, workers=1, project_name=str, retries=1, journal=None, project_key=str):
+    """
+    Call fetch_project for every project, on up to workers threads.
+    A failing project is reported and queued, the failed projects are run
+    again up to retries times once all projects were run, and recorded in
+    the journal under project_key(project). The projects still failing are
+    returned.
+    With more than 1 worker the output of each project is printed as one block.
+    """
+    def run_all(projects):
+        failed = []
+
+        def run(i, project):
+            with buffered_output() if workers > 1 else nullcontext():
+                print(f'{i}. {project_name(project)}:')
+                try:
+                    if fetch_project(project) is False:
+                        failed.append(project)
+                except Exception as e:
+                    print(f"\tERROR: {e!r} while fetching project {project_name(project)}")
+                    failed.append(project)
+                    if journal is not None:
+                        journal.fail(project_key(project), repr(e))
+
+        if workers <= 1:
+            for i, project in enumerate(projects):
+                run(i, project)
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(run, range(len(projects)), projects))
+        return failed
+
+    failed = run_all(projects)
+    for attempt in range(retries):
+        if not failed:
+            break
+        print(f"Retrying {len(failed)} failed project(s), attempt {attempt + 1} of {retries}")
+        failed = run_all(failed)
+
+    if failed:
+        print(f"{len(failed)} project(s) failed: {', '.join(project_name(project) for project in failed)}")
+    return failed
+
+def fetch_organization_sonar_data(output_path, organization = 'apache', server = "https://sonarcloud.io/", component_wise=False, workers=1, catalog=None, resume=False):
 
     print(f"Fetching data from server {server} - organization {organization}")
 
-    metrics = Metrics(server, output_path)
-    metrics.process_elements()
-    server_metrics = metrics.get_server_metrics()
-
-    r = Rules(server, organization)
-    rules = r.get_server_rules()
+    catalog = Catalog(output_path) if catalog is None else catalog
+    server_metrics = catalog.get_server_metrics(server)
+    rules = catalog.get_rules(server, organization)
 
     prj = Projects(server, organization, output_path)
     projects = prj.process_elements()
     projects.sort(key=lambda x: x['key'])
 
     print(f"Total {len(projects)} projects.")
-    i = 0
-    for project in projects:
-        print(f'{i}. {project["name"]}:')
-        i += 1
-        analysis = Analyses(server, organization, output_path, project['key'])
-        analysis.process_elements()
-        analysis_keys_dates = analysis.get_analysis_keys_dates()    # (keys, dates) tuple 
-
-        if len(analysis_keys_dates[0]) == 0:
-            continue
-        print(f"\t{len(analysis_keys_dates[0])} new analyses")
-
-        measure = Measures(server, organization, output_path, project['key'], project['key'], project['key'], analysis_keys_dates, server_metrics)
-        measure.process_elements()
-
-        issues = Issues(server, organization, output_path, project['key'], project['key'], project['key'], analysis_keys_dates, rules)
-        issues.process_elements()
-
-        if not component_wise:
-            continue
 
-        files = Files(server, project['key']).get_files()
-        for file in files:
-            file_key = file[0]
-            file_name = file[1]
-            
-            print(f"\t{file_name} - {file_key}")
+    journal = RunJournal(output_path, resume)
 
-            # Measures are the same for all files
-            
-            # measure = Measures(server, organization, output_path, project['key'], file_key, file_name, analysis_keys_dates, server_metrics)
-            # measure.process_elements()
+    def fetch_project(project):
+        fetch_project_sonar_data(output_path, server, organization, project['key'], server_metrics, rules, component_wise, journal)
 
-            issues = Issues(server, organization, output_path, project['key'], file_key, file_name, analysis_keys_dates, rules)
-            issues.process_elements()
+    return run_projects(projects, fetch_project, workers, project_name=lambda project: project["name"], journal=journal, project_key=lambda project: project["key"])
 
-def fetch_projects_sonar_data(output_path, server, projects, component_wise=False):
+def fetch_projects_sonar_data(output_path, server, projects, component_wise=False, workers=1, catalog=None, resume=False):
 
     print(f"Fetching data from server {server} - project {projects}")
 
-    metrics = Metrics(server, output_path)
-    metrics.process_elements()
-    server_metrics = metrics.get_server_metrics()
+    catalog = Catalog(output_path) if catalog is None else catalog
+    server_metrics = catalog.get_server_metrics(server)
 
     print(f"Total {len(projects)} projects.")
-    i = 0
-    for project in projects:
 
-        print(f'{i}. {project}:')
-        i += 1
-        
+    journal = RunJournal(output_path, resume)
+
+    def fetch_project(project):
         organization = ComponentProject(server, project).get_organization()
         if organization is None:
             print(f"ERROR: Cannot find project {project} on server {server}")
-            sys.exit(1)
-
-        r = Rules(server, organization)
-        rules = r.get_server_rules()
-
-        analysis = Analyses(server, organization, output_path, project)
-        analysis.process_elements()
-        analysis_keys_dates = analysis.get_analysis_keys_dates()    # (keys, dates) tuple 
+            return False
 
-        if len(analysis_keys_dates[0]) == 0:
-            continue
-        print(f"\t{len(analysis_keys_dates[0])} new analyses")
+        rules = catalog.get_rules(server, organization)
 
-        measure = Measures(server, organization, output_path, project, project, project, analysis_keys_dates, server_metrics)
-        measure.process_elements()
+        fetch_project_sonar_data(output_path, server, organization, project, server_metrics, rules, component_wise, journal)
 
-        issues = Issues(server, organization, output_path, project, project, project, analysis_keys_dates, rules)
-        issues.process_elements()
-
-        if not component_wise:
-            continue
+    return run_projects(list(projects), fetch_project, workers, journal=journal)
 
-        files = Files(server, project).get_files()
-        for file in files:
-            file_key = file[0]
-            file_name = file[1]
-            
-            print(f"\t{file_name} - {file_key}")
-
-            # Measures are the same for all files
-            
-            # measure = Measures(server, organization, output_path, project, file_key, file_name, analysis_keys_dates, server_metrics)
-            # measure.process_elements()
+def schedule_organization_sonar_data(output_path, organization = 'apache', server = "https://sonarcloud.io/", component_wise=False, workers=1, catalog=None, resume=False, merge_project=None):
+    """
+    Same as fetch_organization_sonar_data, with every stage of every
+    project a task of a StageScheduler: the metrics and rules catalogs and
+    the project list are fetched at the same time, then the analyses of
+    each project, its measures and issues at the same time, and its
+    component-wise issues. merge_project(project_key), if given, is called
+    as soon as all stages of the project are done. The failed or skipped
+    tasks are returned.
+    """
+    print(f"Fetching data from server {server} - organization {organization}")
 
-            issues = Issues(server, organization, output_path, project, file_key, file_name, analysis_keys_dates, rules)
-            issues.process_elements()
\ No newline at end of file
+    catalog = Catalog(output_path) if catalog is None else catalog
+    journal = RunJournal(output_path, resume)
+    scheduler = StageScheduler(workers)
+    catalogs = {}
+
+    def fetch_metrics():
+        catalogs['server_metrics'] = catalog.get_server_metrics(server)
+
+    def fetch_rules():
+        catalogs['rules'] = catalog.get_rules(server, organization)
+
+    def add_project_tasks(project_key):
+        data = {}
+
+        def fetch_analyses():
+            data['analysis_keys_dates'] = fetch_project_analyses(output_path, server, organization, project_key, journal)
+            print(f"\t{len(data['analysis_keys_dates'][0])} new analyses")
+
+        def fetch_measures():
+            if len(data['analysis_keys_dates'][0]) > 0:
+                fetch_project_measures(output_path, server, organization, project_key, data['analysis_keys_dates'], catalogs['server_metrics'], journal)
+
+        # Issues of the files are written from the project issues, both are one stage
+        def fetch_issues():
+            if journal.is_complete(project_key, ISSUES_STAGE):
+                print("\tAlready fetched in the resumed run")
+            elif len(data['analysis_keys_dates'][0]) > 0:
+                data['issues'] = fetch_project_issues(output_path, server, organization, project_key, data['analysis_keys_dates'], catalogs['rules'])
+
+        def fetch_components():
+            if 'issues' not in data:
+                return
+            if component_wise:
+                fetch_component_issues(output_path, server, organization, project_key, data['analysis_keys_dates'], catalogs['rules'], data['issues'])
+            journal.complete(project_key, ISSUES_STAGE)
+
+        scheduler.add(f"{project_key} analyses", fetch_analyses, ["projects"])
+        scheduler.add(f"{project_key} measures", fetch_measures, [f"{project_key} analyses", "metrics"])
+        scheduler.add(f"{project_key} issues", fetch_issues, [f"{project_key} analyses", "rules"])
+        scheduler.add(f"{project_key} component issues", fetch_components, [f"{project_key} issues"])
+        if merge_project is not None:
+            scheduler.add(f"{project_key} merge", lambda: merge_project(project_key), [f"{project_key} measures", f"{project_key} component issues"])
+
+    def fetch_projects():
+        prj = Projects(server, organization, output_path)
+        projects = prj.process_elements()
+        projects.sort(key=lambda x: x['key'])
+
+        print(f"Total {len(projects)} projects.")
+        for project in projects:
+            add_project_tasks(project['key'])
+
+    scheduler.add("metrics", fetch_metrics)
+    scheduler.add("rules", fetch_rules)
+    scheduler.add("projects", fetch_projects)
+    return scheduler.run()
@@ -0,0 +1,97 @@
+import json
+import threading
+from collections import defaultdict
+from pathlib import Path
+
+from .route_config import RequestsConfig
+from .sonar_metric import Metrics
+from .sonar_rule import Rules
+from .utils import get_proper_file_name, write_json_atomic
+
+# Bump when the layout of the persisted catalogs changes
+CATALOG_FORMAT_VERSION = 1
+
+class Catalog:
+    """
+    Metrics of each server and rules of each (server, organization), loaded
+    once per run and shared by all projects. Catalogs are persisted under
+    <output_path>/catalog and reused by later runs while the server version
+    is unchanged.
+    """
+    def __init__(self, output_path):
+        self.__output_path = output_path
+        self.__server_versions = {}
+        self.__metrics = {}
+        self.__rules = {}
+        self.__lock = threading.Lock()
+        self.__key_locks = defaultdict(threading.Lock)
+
+    def __get_key_lock(self, key):
+        with self.__lock:
+            return self.__key_locks[key]
+
+    def __get_server_version(self, server):
+        with self.__get_key_lock(('version', server)):
+            if server not in self.__server_versions:
+                session = RequestsConfig.route_session(server)
+                response = RequestsConfig.call_api_route(session=session, endpoint=server + "api/server/version", params=None)
+                self.__server_versions[server] = response.text.strip() if response.status_code == 200 else None
+            return self.__server_versions[server]
+
+    def __get_file_path(self, name):
+        return Path(self.__output_path).joinpath("catalog").joinpath(f"{get_proper_file_name(name)}.json")
+
+    def __load(self, name, server_version):
+        file_path = self.__get_file_path(name)
+        if server_version is None or not file_path.exists():
+            return None
+        try:
+            with open(file_path, 'r') as f:
+                catalog = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"\tWARNING: {e} reading catalog {file_path}")
+            return None
+
+        if catalog.get('format_version') != CATALOG_FORMAT_VERSION or catalog.get('server_version') != server_version:
+            return None
+        return catalog['elements']
+
+    def __save(self, name, server_version, elements):
+        file_path = self.__get_file_path(name)
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(file_path, {'format_version': CATALOG_FORMAT_VERSION, 'server_version': server_version, 'elements': elements})
+
+    def get_server_metrics(self, server):
+        with self.__get_key_lock(('metrics', server)):
+            if server not in self.__metrics:
+                name = f"metrics_{server}"
+                server_version = self.__get_server_version(server)
+                server_metrics = self.__load(name, server_version)
+                if server_metrics is None:
+                    metrics = Metrics(server, self.__output_path)
+                    metrics.process_elements()
+                    server_metrics = metrics.get_server_metrics()
+                    # A partial catalog would be reused by later runs
+                    if metrics._failed_pages > 0:
+                        print(f"\tWARNING: {metrics._failed_pages} page(s) of metrics failed, the catalog is not saved")
+                    elif server_metrics:
+                        self.__save(name, server_version, server_metrics)
+                self.__metrics[server] = server_metrics
+            return self.__metrics[server]
+
+    def get_rules(self, server, organization):
+        key = (server, organization)
+        with self.__get_key_lock(('rules',) + key):
+            if key not in self.__rules:
+                name = f"rules_{server}_{organization}"
+                server_version = self.__get_server_version(server)
+                rules = self.__load(name, server_version)
+                if rules is None:
+                    server_rules = Rules(server, organization)
+                    rules = server_rules.get_server_rules()
+                    if server_rules._failed_pages > 0:
+                        print(f"\tWARNING: {server_rules._failed_pages} page(s) of rules failed, the catalog is not saved")
+                    elif rules:
+                        self.__save(name, server_version, rules)
+                self.__rules[key] = rules
+            return self.__rules[key]
@@ -0,0 +1,83 @@
+import json
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# Stages of a project recorded in the journal
+ANALYSES_STAGE = "analyses"
+MEASURES_STAGE = "measures"
+ISSUES_STAGE = "issues"
+
+class RunJournal:
+    """
+    Stages completed by each project during a run, appended as JSON lines
+    to <output_path>/journal.jsonl. A resumed run reads the journal back
+    and skips the completed stages, a new run starts a new journal.
+    Without output_path the journal is only kept in memory.
+    """
+    def __init__(self, output_path=None, resume=False):
+        self.__file_path = None if output_path is None else Path(output_path).joinpath("journal.jsonl")
+        self.__lock = threading.Lock()
+        self.__completed = {}       # (project_key, stage) -> data
+
+        if self.__file_path is None:
+            return
+        if resume:
+            self.__load()
+        else:
+            self.__file_path.unlink(missing_ok=True)
+
+    def __load(self):
+        if not self.__file_path.exists():
+            print(f"WARNING: no journal {self.__file_path} to resume from, starting a new run")
+            return
+        with open(self.__file_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Last line of a run killed while writing it
+                    continue
+                if entry.get('status') == 'done':
+                    self.__completed[(entry['project'], entry['stage'])] = entry.get('data')
+        print(f"Resuming run, {len(self.__completed)} project stages already completed")
+
+    def __append(self, entry):
+        if self.__file_path is None:
+            return
+        self.__file_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.__file_path, 'a') as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def is_complete(self, project_key, stage):
+        with self.__lock:
+            return (project_key, stage) in self.__completed
+
+    def complete(self, project_key, stage, data=None):
+        with self.__lock:
+            self.__completed[(project_key, stage)] = data
+            self.__append({'project': project_key, 'stage': stage, 'status': 'done', 'time': datetime.utcnow().isoformat(), 'data': data})
+
+    def fail(self, project_key, error):
+        """Record a failure, for the record only, the project is run again when resumed."""
+        with self.__lock:
+            self.__append({'project': project_key, 'status': 'failed', 'time': datetime.utcnow().isoformat(), 'error': error})
+
+    def complete_analyses(self, project_key, analysis_keys_dates):
+        """Complete the analyses stage, keeping the new analyses for the next stages of a resumed run."""
+        keys, dates = analysis_keys_dates
+        self.complete(project_key, ANALYSES_STAGE, {
+            'analysis_keys': list(keys),
+            'analysis_dates': [None if pd.isna(date) else pd.Timestamp(date).isoformat() for date in dates],
+        })
+
+    def get_analysis_keys_dates(self, project_key):
+        """(keys, dates) of the new analyses of a completed analyses stage, None if not completed."""
+        with self.__lock:
+            if (project_key, ANALYSES_STAGE) not in self.__completed:
+                return None
+            data = self.__completed[(project_key, ANALYSES_STAGE)]
+        return (data['analysis_keys'], np.array(data['analysis_dates'], dtype='datetime64[ns]'))
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+from .utils import set_file_mode
+
+HOUR = 60 * 60
+DAY = 24 * HOUR
+
+# Time to live of the responses of each endpoint, in seconds.
+# Catalogs rarely change, project data is kept long enough to resume a crashed run.
+ENDPOINT_TTLS = {
+    "api/metrics/search": 7 * DAY,
+    "api/rules/search": 7 * DAY,
+    "api/components/show": 7 * DAY,
+    "api/components/search": DAY,
+    "api/components/tree": DAY,
+}
+
+class ResponseCache:
+    """
+    On-disk cache of JSON responses, keyed by endpoint (server included) and
+    sorted params. Entries expire after the TTL of their endpoint and the least
+    recently used ones are removed when the cache grows over max_bytes.
+    """
+    def __init__(self, directory, default_ttl=12 * HOUR, max_bytes=1024 ** 3, endpoint_ttls=ENDPOINT_TTLS):
+        self.__directory = Path(directory)
+        self.__directory.mkdir(parents=True, exist_ok=True)
+        self.__default_ttl = default_ttl
+        self.__max_bytes = max_bytes
+        self.__endpoint_ttls = endpoint_ttls
+        self.__lock = threading.Lock()
+        self.__size = sum(path.stat().st_size for path in self.__entries())
+
+    def __entries(self):
+        return self.__directory.glob("*/*.json")
+
+    def __get_path(self, endpoint, params):
+        params = sorted((key, str(value)) for key, value in (params or {}).items() if value is not None)
+        digest = hashlib.sha256(json.dumps([endpoint, params]).encode()).hexdigest()
+        return self.__directory.joinpath(digest[:2]).joinpath(f"{digest}.json")
+
+    def __get_ttl(self, endpoint):
+        for endpoint_suffix, ttl in self.__endpoint_ttls.items():
+            if endpoint.endswith(endpoint_suffix):
+                return ttl
+        return self.__default_ttl
+
+    def get(self, endpoint, params):
+        """Return the cached response body, None if absent or expired."""
+        path = self.__get_path(endpoint, params)
+        try:
+            stored_at = path.stat().st_mtime
+            if time.time() - stored_at > self.__get_ttl(endpoint):
+                return None
+            with open(path, 'r') as f:
+                body = json.load(f)
+            # Access time tracks the last use for the LRU eviction
+            os.utime(path, (time.time(), stored_at))
+            return body
+        except (OSError, ValueError):
+            return None
+
+    def put(self, endpoint, params, body):
+        path = self.__get_path(endpoint, params)
+        path.parent.mkdir(parents=True, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, 'w') as f:
+            json.dump(body, f)
+        set_file_mode(tmp_path)
+
+        with self.__lock:
+            old_size = path.stat().st_size if path.exists() else 0
+            os.replace(tmp_path, path)
+            self.__size += path.stat().st_size - old_size
+            if self.__size > self.__max_bytes:
+                self.__evict()
+
+    def __evict(self):
+        # Remove least recently used entries down to 90% of max_bytes
+        entries = []
+        for path in self.__entries():
+            stat = path.stat()
+            entries.append((stat.st_atime, stat.st_size, path))
+        entries.sort()
+
+        self.__size = sum(entry[1] for entry in entries)
+        for _, size, path in entries:
+            if self.__size <= 0.9 * self.__max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            self.__size -= size
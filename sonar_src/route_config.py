@@ -1,22 +1,175 @@
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
 import requests
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
 
+THROTTLE_STATUS_CODES = (429, 503)
+
+def get_server_key(url):
+    url_parts = urlsplit(url)
+    return f"{url_parts.scheme}://{url_parts.netloc}"
+
+def get_retry_after(response):
+    """Seconds to wait according to the Retry-After header, None if absent or invalid."""
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_date = parsedate_to_datetime(value)
+        return max(0.0, (retry_date - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+class RateLimiter:
+    """
+    Token bucket shared by all requests to one server.
+    The rate is halved each time the server throttles us and grows back
+    slowly towards max_rate while requests succeed.
+    """
+    MIN_RATE = 0.2
+    RATE_INCREASE = 0.1
+
+    def __init__(self, max_rate):
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.__tokens = 1.0
+        self.__updated = time.monotonic()
+        self.__blocked_until = 0.0
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                if now >= self.__blocked_until:
+                    capacity = max(1.0, self.rate)
+                    self.__tokens = min(capacity, self.__tokens + (now - self.__updated) * self.rate)
+                    self.__updated = now
+                    if self.__tokens >= 1:
+                        self.__tokens -= 1
+                        return
+                    wait = (1 - self.__tokens) / self.rate
+                else:
+                    wait = self.__blocked_until - now
+            time.sleep(wait)
+
+    def throttled(self, wait):
+        with self.__lock:
+            now = time.monotonic()
+            self.rate = max(self.MIN_RATE, self.rate / 2)
+            self.__tokens = 0.0
+            self.__updated = max(now, self.__updated)
+            self.__blocked_until = max(self.__blocked_until, now + wait)
+
+    def succeeded(self):
+        with self.__lock:
+            self.rate = min(self.max_rate, self.rate + self.RATE_INCREASE)
+
 class RequestsConfig:
-    @staticmethod
-    def route_session():
-        session = requests.Session()
-        retry = Retry(connect=3, backoff_factor=0.5)
-        adapter = HTTPAdapter(max_retries=retry)
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
-        return session
+    # Number of pages, or batches of measure metrics, fetched at the same
+    # time once the total is known.
+    # 1 keeps the sequential behaviour.
+    page_workers = 1
+    # Number of kept-alive connections per server, should cover the number
+    # of requests sent at the same time.
+    pool_size = 10
+    # Maximum number of requests per second sent to one server.
+    rate_limit = 10.0
+    # Number of times a throttled (429/503) request is sent again.
+    throttle_retries = 6
+    # Wait before retrying a throttled request without Retry-After, doubled on each retry.
+    throttle_backoff = 1.0
+    # Optional ResponseCache for JSON responses
+    response_cache = None
 
-    @staticmethod
-    def call_api_route(session, endpoint, params):
-        r = session.get(endpoint, params=params)
+    __sessions = {}
+    __limiters = {}
+    __registry_lock = threading.Lock()
+
+    @classmethod
+    def configure(cls, page_workers=None, pool_size=None, rate_limit=None, response_cache=None):
+        if page_workers is not None:
+            cls.page_workers = max(1, int(page_workers))
+        if pool_size is not None:
+            cls.pool_size = max(1, int(pool_size))
+        if rate_limit is not None:
+            cls.rate_limit = float(rate_limit)
+        if response_cache is not None:
+            cls.response_cache = response_cache
+
+    @classmethod
+    def route_session(cls, url):
+        """
+        Return the session shared by every request to the server of url,
+        created on first use.
+        """
+        server = get_server_key(url)
+
+        with cls.__registry_lock:
+            if server not in cls.__sessions:
+                session = requests.Session()
+                retry = Retry(connect=3, backoff_factor=0.5)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=cls.pool_size, max_retries=retry)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                cls.__sessions[server] = session
+            return cls.__sessions[server]
+
+    @classmethod
+    def route_limiter(cls, url):
+        """Return the rate limiter shared by every request to the server of url."""
+        server = get_server_key(url)
+
+        with cls.__registry_lock:
+            if server not in cls.__limiters:
+                cls.__limiters[server] = RateLimiter(cls.rate_limit)
+            return cls.__limiters[server]
+
+    @classmethod
+    def call_api_route(cls, session, endpoint, params):
+        limiter = cls.route_limiter(endpoint)
+
+        for attempt in range(cls.throttle_retries + 1):
+            limiter.acquire()
+            r = session.get(endpoint, params=params)
+            if r.status_code not in THROTTLE_STATUS_CODES:
+                limiter.succeeded()
+                return r
+
+            wait = get_retry_after(r)
+            if wait is None:
+                wait = cls.throttle_backoff * 2 ** attempt
+            limiter.throttled(wait)
+            if attempt < cls.throttle_retries:
+                print(f"WARNING: HTTP Response code {r.status_code} for request {r.request.path_url}, retrying in {wait:.1f}s")
         return r
 
+    @classmethod
+    def get_json(cls, session, endpoint, params):
+        """Return the JSON body of a successful response, served from the response cache when possible."""
+        if cls.response_cache is not None:
+            body = cls.response_cache.get(endpoint, params)
+            if body is not None:
+                return body
+
+        response = cls.call_api_route(session=session, endpoint=endpoint, params=params)
+        if not cls.check_invalid_status_code(response=response):
+            return None
+        body = response.json()
+
+        if cls.response_cache is not None:
+            cls.response_cache.put(endpoint, params, body)
+        return body
+
     @staticmethod
     def check_invalid_status_code(response):
         if response.status_code != 200:
@@ -0,0 +1,106 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from .utils import buffered_output
+
+# Status of a task
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+SKIPPED = "skipped"
+
+class StageScheduler:
+    """
+    Runs named tasks on up to workers threads, each one as soon as the
+    tasks it depends on are done, in the order they were added. Tasks may
+    add tasks while they run, e.g. the stages of the projects once the
+    project list is known. A failing task is run again up to retries times
+    once nothing else can run, the tasks depending on a task that still
+    fails are skipped.
+    With more than 1 worker the output of each task is printed as one block.
+    """
+    def __init__(self, workers=1, retries=1):
+        self.__workers = max(1, workers)
+        self.__retries = retries
+        self.__tasks = {}           # name -> (function, dependencies)
+        self.__status = {}
+        self.__attempts = {}
+        self.__deferred = []        # failed tasks waiting for their retry
+        self.__running = 0
+        self.__condition = threading.Condition()
+
+    def add(self, name, function, dependencies=()):
+        with self.__condition:
+            if name in self.__tasks:
+                raise ValueError(f"Task {name} already added")
+            self.__tasks[name] = (function, list(dependencies))
+            self.__status[name] = PENDING
+            self.__attempts[name] = 0
+            self.__condition.notify()
+
+    def __run_task(self, name):
+        function = self.__tasks[name][0]
+        with buffered_output() if self.__workers > 1 else nullcontext():
+            print(f"{name}:")
+            try:
+                function()
+                status = DONE
+            except Exception as e:
+                print(f"\tERROR: {e!r} in task {name}")
+                status = FAILED
+
+        with self.__condition:
+            self.__running -= 1
+            self.__attempts[name] += 1
+            if status == FAILED and self.__attempts[name] <= self.__retries:
+                self.__status[name] = PENDING
+                self.__deferred.append(name)
+            else:
+                self.__status[name] = status
+            self.__condition.notify()
+
+    def __get_ready_tasks(self):
+        """Pending tasks whose dependencies are done, skipping those whose dependencies failed."""
+        skipped = True
+        while skipped:
+            skipped = False
+            for name, (function, dependencies) in self.__tasks.items():
+                if self.__status[name] == PENDING and any(self.__status.get(dependency) in (FAILED, SKIPPED) for dependency in dependencies):
+                    print(f"WARNING: skipping task {name}, a task it depends on failed")
+                    self.__status[name] = SKIPPED
+                    skipped = True
+
+        return [name for name, (function, dependencies) in self.__tasks.items()
+                if self.__status[name] == PENDING and name not in self.__deferred
+                and all(self.__status.get(dependency) == DONE for dependency in dependencies)]
+
+    def run(self):
+        """Run the tasks until none can run any more, return the names of the failed or skipped tasks."""
+        with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+            with self.__condition:
+                while True:
+                    for name in self.__get_ready_tasks()[:self.__workers - self.__running]:
+                        self.__status[name] = RUNNING
+                        self.__running += 1
+                        executor.submit(self.__run_task, name)
+
+                    if self.__running > 0:
+                        self.__condition.wait()
+                    elif self.__deferred:
+                        print(f"Retrying {len(self.__deferred)} failed task(s)")
+                        self.__deferred = []
+                    else:
+                        break
+
+        for name, (function, dependencies) in self.__tasks.items():
+            if self.__status[name] == PENDING:
+                missing = [dependency for dependency in dependencies if dependency not in self.__tasks]
+                print(f"WARNING: skipping task {name}, unknown dependencies {missing}")
+                self.__status[name] = SKIPPED
+
+        failed = [name for name, status in self.__status.items() if status in (FAILED, SKIPPED)]
+        if failed:
+            print(f"{len(failed)} task(s) failed or skipped: {', '.join(failed)}")
+        return failed
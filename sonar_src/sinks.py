@@ -0,0 +1,280 @@
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from .utils import get_proper_file_name
+
+# Immutable segments <file_name>.seg-<utc ts>-<id>.csv appended by
+# utils/merge_stage_archive.py until they are compacted into the archive
+SEGMENT_INFIX = ".seg-"
+
+# Columns identifying a row of each SQLite table, a row written again replaces the old one
+SQLITE_UPSERT_KEYS = {
+    'projects': ['organization', 'key'],
+    'analyses': ['project', 'analysis_key'],
+    'measures': ['project', 'analysis_key'],
+    'issues': ['project', 'issue_key', 'update_date'],
+}
+
+# Indexed columns of each SQLite table, besides the upsert keys
+SQLITE_INDEXES = {
+    'analyses': [['date']],
+    'issues': [['issue_key'], ['creation_date'], ['update_date']],
+}
+
+class CsvSink:
+    """
+    Writes <output_path>/<stage>/[<project>/]<file_name>_staging.csv files,
+    appended as segments of the <file_name>.csv archives by utils/merge_stage_archive.py.
+    """
+    def __init__(self, output_path):
+        self._output_path = output_path
+
+    def get_directory(self, stage, organization, project_key, component=False):
+        """Directory of the data of a project."""
+        directory = Path(self._output_path).joinpath(stage)
+        # Component files of a project are grouped in a directory named after the project
+        if component:
+            directory = directory.joinpath(get_proper_file_name(project_key))
+        return directory
+
+    def get_index_path(self, stage, organization, project_key, file_name, component=False):
+        """Path of the side index kept next to the data of file_name."""
+        return self.get_directory(stage, organization, project_key, component).joinpath(f"{file_name}.index.json")
+
+    def write(self, stage, df, organization, project_key, file_name, component=False, append=False, staging=True):
+        directory = self.get_directory(stage, organization, project_key, component)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        file_path = directory.joinpath(f"{file_name}_staging.csv" if staging else f"{file_name}.csv")
+        if append and file_path.exists():
+            df.to_csv(file_path, index=False, header=False, mode='a')
+        else:
+            df.to_csv(file_path, index=False, header=True, mode='w')
+
+    def read(self, stage, organization, project_key, file_name, dtype, parse_dates, component=False, include_staging=False):
+        """
+        Data written so far as one table, archive first then segments and
+        staging, None if there is none.
+        """
+        directory = self.get_directory(stage, organization, project_key, component)
+        file_paths = [directory.joinpath(f"{file_name}.csv")]
+        file_paths += sorted(directory.glob(f"{file_name}{SEGMENT_INFIX}*.csv"))
+        if include_staging:
+            file_paths.append(directory.joinpath(f"{file_name}_staging.csv"))
+
+        dfs = []
+        for file_path in file_paths:
+            if not file_path.exists():
+                continue
+            try:
+                dfs.append(pd.read_csv(file_path.absolute(), dtype=dtype, parse_dates=parse_dates))
+            except Exception as e:
+                print(f"Exception {e} reading file {file_path.absolute()}")
+        if not dfs:
+            return None
+        if len(dfs) == 1:
+            return dfs[0]
+        # Segments may repeat rows until they are compacted
+        return pd.concat(dfs, ignore_index=True).drop_duplicates(keep='last', ignore_index=True)
+
+class ParquetSink(CsvSink):
+    """
+    Writes one immutable Parquet part per call under
+    <output_path>/parquet/<stage>/org=<organization>/proj=<project>/,
+    a Hive-style layout that pyarrow datasets, pandas, Spark or DuckDB can
+    read with partition pruning. The partition keys differ from the
+    organization and project columns kept in the files.
+    Component-wise issues go to the component_issues stage.
+    There is no staging, readers deduplicate.
+    """
+    def __init__(self, output_path):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ImportError("pyarrow is required for the parquet output format: pip install pyarrow")
+        self.__pa = pyarrow
+        self.__pq = pyarrow.parquet
+        CsvSink.__init__(self, output_path)
+
+    def get_directory(self, stage, organization, project_key, component=False):
+        directory = Path(self._output_path).joinpath("parquet").joinpath(f"component_{stage}" if component else stage)
+        directory = directory.joinpath(f"org={get_proper_file_name(organization)}")
+        if project_key is not None:
+            directory = directory.joinpath(f"proj={get_proper_file_name(project_key)}")
+        return directory
+
+    def get_index_path(self, stage, organization, project_key, file_name, component=False):
+        # Files starting with _ are skipped by Parquet dataset readers
+        return self.get_directory(stage, organization, project_key, component).joinpath(f"_{file_name}.index.json")
+
+    def __to_table(self, df):
+        columns = {}
+        for column in df.columns:
+            try:
+                self.__pa.array(df[column], from_pandas=True)
+                columns[column] = df[column]
+            except (self.__pa.ArrowInvalid, self.__pa.ArrowTypeError):
+                # Mixed types, e.g. MILLISEC measures holding dates and integers
+                columns[column] = df[column].map(lambda value: None if pd.isna(value) else str(value))
+        return self.__pa.Table.from_pandas(pd.DataFrame(columns, columns=df.columns), preserve_index=False)
+
+    def write(self, stage, df, organization, project_key, file_name, component=False, append=False, staging=True):
+        if df.empty:
+            return
+        directory = self.get_directory(stage, organization, project_key, component)
+        directory.mkdir(parents=True, exist_ok=True)
+
+        part_name = f"{file_name}.part-{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}.parquet"
+        self.__pq.write_table(self.__to_table(df), directory.joinpath(part_name))
+
+    def read(self, stage, organization, project_key, file_name, dtype, parse_dates, component=False, include_staging=False):
+        directory = self.get_directory(stage, organization, project_key, component)
+        file_paths = sorted(directory.glob(f"{file_name}.part-*.parquet"))
+        if not file_paths:
+            return None
+        return pd.concat([pd.read_parquet(file_path) for file_path in file_paths], ignore_index=True)
+
+def get_sql_type(dtype):
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+class SqliteSink(CsvSink):
+    """
+    Writes every stage to one table of <output_path>/sonar.sqlite, with
+    the columns of the data frames and an index on the upsert keys and
+    dates. Rows are upserted in one transaction per write, so there is
+    neither staging nor merge. Component-wise data goes to component_<stage>
+    tables, with the file_name of the component. Side files, such as the
+    issues indexes, are kept under <output_path>/sqlite.
+    """
+    __connections = {}
+    __registry_lock = threading.Lock()
+
+    @classmethod
+    def __get_connection(cls, db_path):
+        # One connection per database, shared by the threads of the run
+        key = str(db_path.resolve())
+        with cls.__registry_lock:
+            if key not in cls.__connections:
+                db_path.parent.mkdir(parents=True, exist_ok=True)
+                connection = sqlite3.connect(db_path, check_same_thread=False)
+                connection.execute("PRAGMA journal_mode=WAL")
+                cls.__connections[key] = (connection, threading.Lock())
+            return cls.__connections[key]
+
+    def get_directory(self, stage, organization, project_key, component=False):
+        directory = Path(self._output_path).joinpath("sqlite").joinpath(stage)
+        if component:
+            directory = directory.joinpath(get_proper_file_name(project_key))
+        return directory
+
+    @property
+    def __connection(self):
+        # Opened on first use, objects without output path never use it
+        return self.__get_connection(Path(self._output_path).joinpath("sonar.sqlite"))[0]
+
+    @property
+    def __lock(self):
+        return self.__get_connection(Path(self._output_path).joinpath("sonar.sqlite"))[1]
+
+    def __get_columns(self, table):
+        return [row[1] for row in self.__connection.execute(f'PRAGMA table_info("{table}")')]
+
+    def __prepare_table(self, table, stage, df):
+        """Create the table and its indexes, or add the columns it misses, e.g. of new metrics."""
+        columns = self.__get_columns(table)
+        if not columns:
+            definitions = ', '.join(f'"{column}" {get_sql_type(df[column].dtype)}' for column in df.columns)
+            self.__connection.execute(f'CREATE TABLE "{table}" ({definitions})')
+
+            keys = [column for column in SQLITE_UPSERT_KEYS.get(stage, []) if column in df.columns]
+            if 'file_name' in df.columns:
+                keys.insert(1, 'file_name')
+            if keys:
+                # Unique indexes treat NULLs as distinct, rows with a NULL key column would never be replaced
+                key_expressions = ', '.join(f"IFNULL(\"{column}\", '')" for column in keys)
+                self.__connection.execute(f'CREATE UNIQUE INDEX "{table}_key" ON "{table}" ({key_expressions})')
+            for index_columns in SQLITE_INDEXES.get(stage, []):
+                self.__connection.execute(f'CREATE INDEX "{table}_{"_".join(index_columns)}" ON "{table}" ({", ".join(index_columns)})')
+            return
+
+        for column in df.columns:
+            if column not in columns:
+                self.__connection.execute(f'ALTER TABLE "{table}" ADD COLUMN "{column}" {get_sql_type(df[column].dtype)}')
+
+    def __to_rows(self, df):
+        columns = []
+        for column in df.columns:
+            values = df[column]
+            if pd.api.types.is_datetime64_any_dtype(values):
+                values = values.dt.strftime('%Y-%m-%d %H:%M:%S')
+            elif values.dtype == object:
+                # e.g. MILLISEC measures holding dates
+                values = values.map(lambda value: str(value) if isinstance(value, datetime) else value)
+            values = values.astype(object)
+            columns.append(values.where(values.notna(), None))
+        return list(zip(*columns))
+
+    def write(self, stage, df, organization, project_key, file_name, component=False, append=False, staging=True):
+        if df.empty:
+            return
+        table = f"component_{stage}" if component else stage
+        if component:
+            df = df.assign(file_name=file_name)
+
+        columns = ', '.join(f'"{column}"' for column in df.columns)
+        placeholders = ', '.join('?' * len(df.columns))
+        rows = self.__to_rows(df)
+        with self.__lock, self.__connection:
+            self.__prepare_table(table, stage, df)
+            self.__connection.executemany(f'INSERT OR REPLACE INTO "{table}" ({columns}) VALUES ({placeholders})', rows)
+
+    def read(self, stage, organization, project_key, file_name, dtype, parse_dates, component=False, include_staging=False):
+        table = f"component_{stage}" if component else stage
+        query = f'SELECT * FROM "{table}" WHERE organization = ? AND project = ?'
+        params = [organization, project_key]
+        if component:
+            query += ' AND file_name = ?'
+            params.append(file_name)
+
+        with self.__lock:
+            if not self.__get_columns(table):
+                return None
+            df = pd.read_sql_query(query, self.__connection, params=params)
+        if df.empty:
+            return None
+
+        df = df.drop(columns=['file_name'], errors='ignore')
+        parse_dates = parse_dates or []
+        df = df.astype({column: column_type for column, column_type in (dtype or {}).items() if column in df.columns and column not in parse_dates})
+        for column in parse_dates:
+            df[column] = pd.to_datetime(df[column])
+        return df
+
+class SinkConfig:
+    OUTPUT_FORMATS = {
+        'csv': CsvSink,
+        'parquet': ParquetSink,
+        'sqlite': SqliteSink,
+    }
+    output_format = 'csv'
+
+    @classmethod
+    def configure(cls, output_format=None):
+        if output_format is not None:
+            if output_format not in cls.OUTPUT_FORMATS:
+                raise ValueError(f"Unknown output format {output_format}, expected one of {list(cls.OUTPUT_FORMATS)}")
+            cls.output_format = output_format
+
+    @classmethod
+    def get_sink(cls, output_path):
+        return cls.OUTPUT_FORMATS[cls.output_format](output_path)
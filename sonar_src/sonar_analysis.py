@@ -1,9 +1,9 @@
 from collections import OrderedDict
 import pandas as pd
-from pathlib import Path
 
 from .sonar_object import SonarObject
-from .utils import process_datetime, get_proper_file_name
+from .state import StateManifest, LAST_ANALYSIS_DATE, LAST_MEASURE_DATE, LAST_ISSUE_ANALYSIS_DATE
+from .utils import process_datetimes, get_proper_file_name
 
 SONAR_ANALYSES_DTYPE = OrderedDict({
         "organization": "object",
@@ -35,73 +35,70 @@ class Analyses(SonarObject):
         self.__analysis_dates = []          # to return, different from element_list
         self.__latest_ts = None
         self.__file_name = get_proper_file_name(self.__project_key)
+        self.__state = StateManifest.get_manifest(output_path)
 
     def __get_last_analysis_ts_on_file(self):
 
-        output_path = Path(self._output_path).joinpath("analyses")
-        if not output_path.exists():
+        analyses_df = self._sink.read("analyses", self.__organization, self.__project_key, self.__file_name, dtype=SONAR_ANALYSES_DTYPE, parse_dates=['date'])
+        if analyses_df is None or analyses_df.empty:
             return None
-
-        archive_file_path = output_path.joinpath(f"{self.__file_name}.csv")
-        if not archive_file_path.exists():
+        return analyses_df['date'].max()
+
+    def __get_latest_ts(self):
+        stages = [LAST_MEASURE_DATE, LAST_ISSUE_ANALYSIS_DATE]
+        latest_ts = self.__state.get(self.__project_key, LAST_ANALYSIS_DATE)
+        # Projects mined before the state manifest existed, the measures and
+        # issues of their archived analyses are taken as written
+        if latest_ts is None:
+            latest_ts = self.__get_last_analysis_ts_on_file()
+            for name in stages:
+                self.__state.update(self.__project_key, name, latest_ts)
+            return latest_ts
+
+        # Analyses whose measures or issues were not written, e.g. after a
+        # crash or a failed stage, are fetched again, all of them if a stage
+        # never completed
+        for name in stages:
+            stage_ts = self.__state.get(self.__project_key, name)
+            if stage_ts is None:
                 return None
-        try:
-            analyses_df = pd.read_csv(archive_file_path.absolute(), dtype=SONAR_ANALYSES_DTYPE, parse_dates=['date'])
-            last_analysis_ts = analyses_df['date'].max()
-
-            return last_analysis_ts
-        except Exception as e:
-            print(f"Exception {e} reading latest analysis timestamp from file {archive_file_path}")
-            return None
+            latest_ts = min(latest_ts, stage_ts)
+        return latest_ts
 
-    def _write_csv(self):
-        analysis_list = []
-        last_analysis_ts = self.__get_last_analysis_ts_on_file()
-        for analysis in self._element_list:
+    def _write_csv(self, analyses):
+        analyses = list(analyses)
+        last_analysis_ts = self.__latest_ts
 
-            analysis_key = None if 'key' not in analysis else analysis['key']
-            date = None if 'date' not in analysis else process_datetime(analysis['date'])
-            if date is not None and last_analysis_ts is not None and date <= last_analysis_ts:
-                continue
-            project_version = None if 'projectVersion' not in analysis else analysis['projectVersion']
-            revision = None if 'revision' not in analysis else analysis['revision']
-            line = (self.__organization, self.__project_key, analysis_key, date, project_version, revision)
-            analysis_list.append(line)
+        df = pd.DataFrame(data={
+            "organization": [self.__organization] * len(analyses),
+            "project": [self.__project_key] * len(analyses),
+            "analysis_key": [analysis.get('key') for analysis in analyses],
+            "date": process_datetimes([analysis.get('date') for analysis in analyses]),
+            "project_version": [analysis.get('projectVersion') for analysis in analyses],
+            "revision": [analysis.get('revision') for analysis in analyses],
+        }, columns=list(SONAR_ANALYSES_DTYPE.keys()))
 
-        if analysis_list:
+        if last_analysis_ts is not None:
+            df = df[df['date'].isna() | (df['date'] > last_analysis_ts)]
 
-            output_path = Path(self._output_path).joinpath("analyses")
-            output_path.mkdir(parents=True, exist_ok=True)
+        if not df.empty:
 
-            file_path = output_path.joinpath(f"{self.__file_name}_staging.csv")
-
-            df = pd.DataFrame(data=analysis_list, columns=list(SONAR_ANALYSES_DTYPE.keys()))
-            df.to_csv(file_path, index=False, header=True, mode='w')
+            # Staging is appended, analyses of a previous not merged run are not fetched again
+            self._sink.write("analyses", df, self.__organization, self.__project_key, self.__file_name, append=True)
             self.__analysis_keys = df['analysis_key'].values.tolist()
             self.__analysis_dates = df['date'].values
 
+        self.__state.update(self.__project_key, LAST_ANALYSIS_DATE, df['date'].max() if not df.empty else last_analysis_ts)
+
     # Try to read latest timestamp recorded to get only later analyses
     def __prepare_anlysis_query(self):
-        output_path = Path(self._output_path).joinpath("analyses")
-        output_path.mkdir(parents=True, exist_ok=True)
-            
-        archive_file = output_path.joinpath(f"{self.__file_name}.csv")
-
-        latest_ts = None
-        if archive_file.exists():
-            try:
-                old_df = pd.read_csv(archive_file.absolute(), dtype=SONAR_ANALYSES_DTYPE, parse_dates=['date'])
-                latest_ts = old_df['date'].max()
-                latest_ts_str = latest_ts.strftime(format = '%Y-%m-%d')
-                self._params['from'] = latest_ts.strftime(format = latest_ts_str)
-
-            except Exception as e:
-                print(f"\t\tERROR: {e} when parsing {archive_file} into DataFrame.")
+        self.__latest_ts = self.__get_latest_ts()
+        if self.__latest_ts is not None:
+            self._params['from'] = self.__latest_ts.strftime(format = '%Y-%m-%d')
         
     def process_elements(self):
         self.__prepare_anlysis_query()
-        self._query_server(key = 'analyses')
-        self._write_csv()
+        self._write_csv(self._iter_elements(key = 'analyses'))
 
     def get_analysis_keys_dates(self):
         return (self.__analysis_keys, self.__analysis_dates)
@@ -19,13 +19,11 @@ class Files(SonarObject):
         )
 
     def get_files(self):
-        self._query_server(key = "components")
-
         file_keys = []
         file_names = []
         name_records = {} # In case of duplicate file names
 
-        for e in self._element_list:
+        for e in self._iter_elements(key = "components"):
             file_keys.append(e["key"])
 
             name = e["name"]
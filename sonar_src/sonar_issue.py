@@ -1,15 +1,26 @@
 import pandas as pd
 from collections import OrderedDict
-from pathlib import Path
 from datetime import datetime, timedelta
+from itertools import islice
 import numpy as np
+import json
 import sys
 
-from .utils import process_datetime, get_duration_from_str, get_proper_file_name
-from .sonar_object import SonarObject
+from .utils import process_datetime, process_datetimes, get_durations_from_str, get_proper_file_name, write_json_atomic
+from .sonar_object import SonarObject, root_total
 from .route_config import RequestsConfig
+from .state import StateManifest, LAST_ISSUE_UPDATE, LAST_ISSUE_RECONCILIATION, LAST_ISSUE_ANALYSIS_DATE
 
 ISSUES_PAGE_SIZE = 500
+# Elasticsearch window, api/issues/search does not return more issues per query
+MAX_ISSUES_NUM = 10000
+ISSUES_FACETS = "rules,severities,types"
+# Facets list at most this many values, the most frequent first
+MAX_FACET_VALUES = 100
+# Keeps the rules parameter of combined rule queries within URL length limits
+MAX_RULES_PER_QUERY = 50
+# Number of fetched issues turned into a DataFrame at once
+NORMALIZE_BATCH_SIZE = 10000
 
 SONAR_ISSUES_TYPE = OrderedDict({
     "organization": "object",
@@ -39,20 +50,56 @@ SONAR_ISSUES_TYPE = OrderedDict({
     "from_hotspot": "object"
 })
 
-def get_analysis_key(date, key_date_list):
+def get_issues_fingerprints(issues_df):
+    """
+    Hash of each row of an issues frame. Rows read back from a CSV file
+    have the same hash as the rows they were written from.
+    """
+    columns = list(SONAR_ISSUES_TYPE.keys())
+    return pd.util.hash_pandas_object(issues_df[columns].astype("string"), index=False)
+
+def format_datetime(ts):
+    # Timestamps are UTC, see process_datetime
+    return ts.strftime("%Y-%m-%dT%H:%M:%S+0000")
+
+def get_analysis_keys(dates, key_date_list):
+    """
+    For each date, key of the latest analysis done at or before it, or of the
+    oldest analysis if there is none. key_date_list is in decreasing date order.
+    Missing dates get None.
+    """
+    # Ascending order for the binary search
+    analysis_keys = np.array([key for key, _ in reversed(key_date_list)], dtype=object)
+    analysis_dates = np.array([date for _, date in reversed(key_date_list)], dtype='datetime64[ns]')
+
+    dates = pd.to_datetime(pd.Series(dates)).values
+    indexes = np.searchsorted(analysis_dates, dates, side='right') - 1
+    keys = analysis_keys[np.clip(indexes, 0, None)]
+    keys[pd.isna(dates)] = None
+    return keys.tolist()
 
-    date = np.datetime64(date)
-    for i in range(len(key_date_list)):
-        analysis_date = key_date_list[i][1]
-        if date >= analysis_date:
-            return key_date_list[i][0]
-    return key_date_list[-1][0]
+def get_analysis_key(date, key_date_list):
+    return get_analysis_keys([date], key_date_list)[0]
 
 def get_creation_analysis_key(issue_key, creation_date, issue_key_analysis_map, key_date_list):
     if issue_key not in issue_key_analysis_map:
         return get_analysis_key(creation_date, key_date_list)
     return issue_key_analysis_map[issue_key]
 
+class IssuesConfig:
+    # Fetch only the issues of a project updated since the last run
+    incremental = False
+    # Days after which an incremental run fetches all issues again,
+    # catching up with deleted issues
+    reconcile_days = 7
+
+    @classmethod
+    def configure(cls, incremental=None, reconcile_days=None):
+        if incremental is not None:
+            cls.incremental = incremental
+        if reconcile_days is not None:
+            cls.reconcile_days = float(reconcile_days)
+
 class Issues(SonarObject):
     def __init__(self, server, organization, output_path, project_key, component_key, component_name, analysis_keys_dates, rules):
         SonarObject.__init__(
@@ -74,146 +121,291 @@ class Issues(SonarObject):
         self._element_list = []
         self.__file_name = get_proper_file_name(component_name)
         self.__rules = rules
-
-    def _more_elements(self, issues_num):
-        max_issues_num = issues_num if issues_num <= 10000 else 10000
-        if self._params['p'] * self._params['ps'] < max_issues_num:
-            return True
-        return False
-
-    def _sub_query_server(self):
-        response_dict = self._call_api()
-        if response_dict is None:
-            return []
-
-        issues = response_dict["issues"]
-        issues_num = response_dict['total']
-        
-        if self._more_elements(issues_num):
-            self._params['p'] += 1
-            issues += self._sub_query_server()
-
-        return issues
-
-    def _query_server(self):
-
-        # First api call to check total number of issues
-        self._params["ps"] = 1  # Reduce data to load
-        response_dict = self._call_api()
+        self.__issues_df = None
+        # Params of the queries that hit the MAX_ISSUES_NUM cap
+        self.__truncated_params = []
+        # Whether all issues were queried, not only the updated ones
+        self.__full_fetch = False
+        # Whether the issues could be queried at all
+        self.__queried = False
+        # Whether pages of the issues written failed, their issues are missing
+        self.__pages_failed = False
+        self.__state = StateManifest.get_manifest(output_path)
+
+    def _sub_query_server(self, params):
+        for response_dict in self._iter_pages(root_total, max_elements=MAX_ISSUES_NUM, params=params):
+            yield from response_dict["issues"]
+
+    def __probe_issues(self, params):
+        """
+        Return the number of issues of params and the distribution of their
+        rules, severities and types as {facet: {value: count}}.
+        """
+        response_dict = self._call_api(dict(params, p=1, ps=1, facets=ISSUES_FACETS))
         if response_dict is None:
+            return None, None
+
+        facets = {}
+        for facet in response_dict.get('facets', []):
+            facets[facet['property']] = {value['val']: value['count'] for value in facet['values'] if value['count'] > 0}
+        return response_dict['total'], facets
+
+    def __get_creation_window(self, params):
+        """[createdAfter, createdBefore) range containing the creation dates of all issues of params."""
+        creation_dates = []
+        for ascending in ['true', 'false']:
+            response_dict = self._call_api(dict(params, p=1, ps=1, s='CREATION_DATE', asc=ascending))
+            if response_dict is None or not response_dict['issues']:
+                return None
+            creation_dates.append(process_datetime(response_dict['issues'][0]['creationDate']))
+        return creation_dates[0], creation_dates[1] + timedelta(seconds=1)
+
+    def __partition_by_rules(self, params, rule_counts, window):
+        """
+        Group the rules with issues into queries of at most MAX_ISSUES_NUM issues,
+        biggest rules first. A rule with more issues is partitioned on its own.
+        """
+        groups = []     # [issues count, rules]
+        for rule, count in sorted(rule_counts.items(), key=lambda x: x[1], reverse=True):
+            if count > MAX_ISSUES_NUM:
+                yield from self.__partition(dict(params, rules=rule), count, window)
+                continue
+
+            for group in groups:
+                if group[0] + count <= MAX_ISSUES_NUM and len(group[1]) < MAX_RULES_PER_QUERY:
+                    group[0] += count
+                    group[1].append(rule)
+                    break
+            else:
+                groups.append([count, [rule]])
+
+        for _, rules in groups:
+            yield dict(params, rules=','.join(rules))
+
+    def __partition(self, params, total, window, facets=None):
+        """
+        Yield the params of queries returning at most MAX_ISSUES_NUM issues each
+        and covering all issues of params.
+        When the rules facet covers all issues, only rules with issues are queried,
+        grouped together. Otherwise window, the [createdAfter, createdBefore)
+        creation date range of params, is bisected while it is wider than a
+        second, then the issues are split by severity, type and finally by rule.
+        """
+        if total is not None and total <= MAX_ISSUES_NUM:
+            yield params
             return
-        total_issues = response_dict['total']
-
-        if total_issues > 10000:
-            
-            for severity in ["INFO", "MINOR", "MAJOR", "CRITICAL", "BLOCKER"]:
-                
-                self._params['severities'] = severity
-                self._params["ps"] = 1
-                response_dict = self._call_api()
-                if response_dict is None:
-                    return
-                severity_total_issues = response_dict['total']
-                self._params["ps"] = ISSUES_PAGE_SIZE
-
-                # Still >10000 issues for the severity,
-                # iterate by rules,
-                if severity_total_issues > 10000:
-                    for rule in self.__rules:
-                        self._params['rules'] = rule
-                        self._element_list += self._sub_query_server()
-                        self._params['p'] = 1
-                        self._params['rules'] = None
-                else:
-                    self._element_list += self._sub_query_server()
-                self._params['p'] = 1
-                self._params['severities'] = None
 
-        else:
-            self._params["ps"] = ISSUES_PAGE_SIZE
-            self._element_list += self._sub_query_server()
+        if total is None or facets is None:
+            total, facets = self.__probe_issues(params)
+            if total is None:
+                self.__truncated_params.append(params)
+            if total is None or total <= MAX_ISSUES_NUM:
+                yield params
+                return
+
+        rule_counts = facets.get('rules', {})
+        if 'rules' not in params and sum(rule_counts.values()) == total:
+            yield from self.__partition_by_rules(params, rule_counts, window)
+            return
 
-    def __get_old_issues_df(self):
+        if window is None:
+            window = self.__get_creation_window(params)
+            if window is None:
+                self.__truncated_params.append(params)
+                yield params
+                return
+
+        created_after, created_before = window
+        if created_before - created_after > timedelta(seconds=1):
+            middle = created_after + timedelta(seconds=(created_before - created_after).total_seconds() // 2)
+            left_params = dict(params, createdAfter=format_datetime(created_after), createdBefore=format_datetime(middle))
+            right_params = dict(params, createdAfter=format_datetime(middle), createdBefore=format_datetime(created_before))
+
+            # The 2 halves are disjoint, the right count is deduced from the left one
+            left_total, left_facets = self.__probe_issues(left_params)
+            right_total = None if left_total is None else total - left_total
+
+            if left_total != 0:
+                yield from self.__partition(left_params, left_total, (created_after, middle), left_facets)
+            if right_total != 0:
+                yield from self.__partition(right_params, right_total, (middle, created_before))
+
+        elif 'severities' not in params and 'severities' in facets:
+            for severity, count in facets['severities'].items():
+                yield from self.__partition(dict(params, severities=severity), count, window)
+
+        elif 'types' not in params and 'types' in facets:
+            for issue_type, count in facets['types'].items():
+                yield from self.__partition(dict(params, types=issue_type), count, window)
+
+        elif 'rules' not in params:
+            # The rules facet only lists the most frequent rules,
+            # the other rules of the server are queried in groups
+            yield from self.__partition_by_rules(params, rule_counts, window)
+            other_rules = [rule for rule in self.__rules if rule not in rule_counts]
+            for i in range(0, len(other_rules), MAX_RULES_PER_QUERY):
+                rules_params = dict(params, rules=','.join(other_rules[i:i + MAX_RULES_PER_QUERY]))
+                yield from self.__partition(rules_params, None, window)
 
-        # Condition: query issues data for component file in the project
-        if self.__project_key != self.__component_key:
-            issues_archive_file_path = Path(self._output_path).joinpath("issues").joinpath(get_proper_file_name(self.__project_key)).joinpath(f"{self.__file_name}.csv") 
         else:
-            issues_archive_file_path = Path(self._output_path).joinpath("issues").joinpath(f"{self.__file_name}.csv") 
+            print(f"\tWARNING: more than {MAX_ISSUES_NUM} issues for {params}, only the first {MAX_ISSUES_NUM} are fetched.")
+            self.__truncated_params.append(params)
+            yield params
 
-        if not issues_archive_file_path.exists():
+    def __get_last_update(self):
+        """Watermark of an incremental fetch, None when all issues have to be fetched."""
+        if not IssuesConfig.incremental or self.__component_key != self.__project_key:
             return None
-        
-        try:
-            old_issues_df = pd.read_csv(issues_archive_file_path.absolute(), dtype=SONAR_ISSUES_TYPE, parse_dates=["creation_date", "update_date", "close_date"])
-            return old_issues_df
 
-        except Exception as e:
-            print(f"Exception {e} reading latest analysis timestamp from file {issues_archive_file_path.absolute()}")
+        last_reconciliation = self.__state.get(self.__project_key, LAST_ISSUE_RECONCILIATION)
+        if last_reconciliation is None or datetime.utcnow() - last_reconciliation > timedelta(days=IssuesConfig.reconcile_days):
             return None
+        return self.__state.get(self.__project_key, LAST_ISSUE_UPDATE)
+
+    def __query_updated_issues(self, last_update):
+        """
+        Issues updated since last_update, most recently updated first.
+        None if some of them cannot be fetched, e.g. more than MAX_ISSUES_NUM were
+        updated or a page failed.
+        """
+        params = dict(self._params, p=1, ps=ISSUES_PAGE_SIZE, s='UPDATE_DATE', asc='false')
+        failed_pages = self._failed_pages
+        issues = []
+        for response_dict in self._iter_pages(root_total, max_elements=MAX_ISSUES_NUM, params=params):
+            # Issues of a failed page may be older than the watermark, or not
+            if self._failed_pages > failed_pages:
+                return None
+            for issue in response_dict["issues"]:
+                # Issues updated at the watermark are fetched again, the index skips the unchanged ones
+                if process_datetime(issue['updateDate']) < last_update:
+                    return issues
+                issues.append(issue)
+
+        if self._failed_pages > failed_pages or len(issues) >= MAX_ISSUES_NUM or len(issues) < self._total_num_elements:
+            return None
+        return issues
 
-    def _write_csv(self):
+    # Generator, issues are yielded page by page
+    def _query_server(self):
 
-        if not self._element_list:
-            print("\tNo issues queried.")
+        last_update = self.__get_last_update()
+        if last_update is not None:
+            issues = self.__query_updated_issues(last_update)
+            if issues is not None:
+                print(f"\t{len(issues)} issues updated since {last_update}")
+                self.__queried = True
+                yield from issues
+                return
+            print("\tWARNING: cannot fetch the updated issues only, fetching all issues")
+
+        # Pages of the incremental query that failed are not missing
+        failed_pages = self._failed_pages
+
+        # First api call to check total number of issues and their distribution
+        total_issues, facets = self.__probe_issues(self._params)
+        if total_issues is None:
             return
+        self.__full_fetch = True
+        self.__queried = True
 
-        # Condition: query issues data for component file in the project
-        if self.__project_key != self.__component_key:
-            output_path = Path(self._output_path).joinpath("issues").joinpath(get_proper_file_name(self.__project_key))
+        if total_issues > MAX_ISSUES_NUM:
+            partitions = list(self.__partition(self._params, total_issues, None, facets))
+            print(f"\t{total_issues} issues, fetched in {len(partitions)} queries")
         else:
-            output_path = Path(self._output_path).joinpath("issues")
-
-        output_path.mkdir(parents=True, exist_ok=True)
-        
-        file_path = output_path.joinpath(f"{self.__file_name}_staging.csv")
-    
-        issues = []
+            partitions = [self._params]
+
+        for params in partitions:
+            yield from self._sub_query_server(dict(params, p=1, ps=ISSUES_PAGE_SIZE))
+
+        if self._failed_pages > failed_pages:
+            print(f"\tWARNING: {self._failed_pages - failed_pages} page(s) of issues failed")
+            self.__pages_failed = True
+
+    def __get_issues_index(self, index_path, component_key, file_name):
+        """
+        issue_key -> fingerprint of the latest row written for the issue.
+        Built once from the archive and staging files if the index does not exist yet.
+        """
+        if index_path.exists():
+            try:
+                with open(index_path, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Exception {e} reading issues index {index_path.absolute()}, rebuilding it")
+
+        index = {}
+        old_issues_df = self._sink.read("issues", self.__organizaiton, self.__project_key, file_name, dtype=SONAR_ISSUES_TYPE,
+                                        parse_dates=["creation_date", "update_date", "close_date"],
+                                        component=self.__project_key != component_key, include_staging=True)
+        if old_issues_df is not None:
+            old_issues_df = old_issues_df.sort_values("update_date", kind="stable", na_position="first")
+            index.update(zip(old_issues_df["issue_key"], get_issues_fingerprints(old_issues_df).tolist()))
+        return index
 
-        for project_issue in self._element_list:
+    def __write_issues_df(self, issues_df, component_key, file_name):
 
-            update_date = None if 'updateDate' not in project_issue else process_datetime(project_issue['updateDate'])
-            current_analysis_key = None if update_date is None else get_analysis_key(update_date, self.__analysis_keys_dates)
+        # Condition: query issues data for component file in the project
+        component = self.__project_key != component_key
+        index_path = self._sink.get_index_path("issues", self.__organizaiton, self.__project_key, file_name, component)
+        index_path.parent.mkdir(parents=True, exist_ok=True)
 
-            issue_key = None if 'key' not in project_issue else project_issue['key']
-            creation_date = None if 'creationDate' not in project_issue else process_datetime(
-                project_issue['creationDate'])
-            creation_analysis_key = None if creation_date is None else get_analysis_key(creation_date, self.__analysis_keys_dates)
+        # Issues are new when their fingerprint differs from the latest one written
+        index = self.__get_issues_index(index_path, component_key, file_name)
+        fingerprints = get_issues_fingerprints(issues_df).tolist()
+        is_new = [index.get(issue_key) != fingerprint for issue_key, fingerprint in zip(issues_df["issue_key"], fingerprints)]
+        new_issues_df = issues_df[is_new]
 
-            close_date = None if 'closeDate' not in project_issue else process_datetime(project_issue['closeDate'])
-            rule = None if 'rule' not in project_issue else project_issue['rule']
-            severity = None if 'severity' not in project_issue else project_issue['severity']
-            status = None if 'status' not in project_issue else project_issue['status']
-            resolution = None if 'resolution' not in project_issue else project_issue['resolution']
-            effort = None if 'effort' not in project_issue else get_duration_from_str(project_issue['effort'])
-            debt = None if 'debt' not in project_issue else get_duration_from_str(project_issue['debt'])
+        print(f"\t{new_issues_df.shape[0]} new issues")
 
-            if 'tags' not in project_issue or len(project_issue['tags']) == 0:
-                tags = None
-            else:
-                tags = ','.join(project_issue['tags'])
-            issue_type = None if 'type' not in project_issue else project_issue['type']
-            message = None if 'message' not in project_issue else project_issue['message']
-            component = None if 'component' not in project_issue else project_issue['component']
-            start_line = None if 'textRange' not in project_issue else None if 'startLine' not in project_issue[
-                'textRange'] \
-                else project_issue['textRange']['startLine']
-            end_line = None if 'textRange' not in project_issue else None if 'endLine' not in project_issue[
-                'textRange'] else project_issue['textRange']['endLine']
-            start_offset = None if 'textRange' not in project_issue else None if 'startOffset' not in project_issue[
-                'textRange'] else project_issue['textRange']['startOffset']
-            end_offset = None if 'textRange' not in project_issue else None if 'endOffset' not in project_issue[
-                'textRange'] else project_issue['textRange']['endOffset']
-            hash_value = None if 'hash' not in project_issue else project_issue['hash']
-            from_hotspot = None if 'fromHotspot' not in project_issue else str(project_issue['fromHotspot'])
-
-            issue = (self.__organizaiton, self.__project_key, current_analysis_key, creation_analysis_key, issue_key, issue_type, rule,
-                        severity, status, resolution, effort, debt, tags, creation_date, update_date, close_date, message,
-                        component, start_line, end_line, start_offset, end_offset, hash_value, from_hotspot)
-            issues.append(issue)
-
-        issues_df = pd.DataFrame(data=issues, columns=SONAR_ISSUES_TYPE.keys())
-        issues_df = issues_df.astype({
+        # Not merged staging rows are kept, they are already in the index
+        self._sink.write("issues", new_issues_df, self.__organizaiton, self.__project_key, file_name, component=component, append=True)
+
+        index.update((issue_key, fingerprint) for issue_key, fingerprint, new in zip(issues_df["issue_key"], fingerprints, is_new) if new)
+        write_json_atomic(index_path, index)
+
+    def __normalize_issues(self, project_issues):
+        """Build the SONAR_ISSUES_TYPE frame of a batch of issues, field by field."""
+        num_issues = len(project_issues)
+        text_ranges = [project_issue.get('textRange') or {} for project_issue in project_issues]
+
+        def get_field(field):
+            return [project_issue.get(field) for project_issue in project_issues]
+
+        def get_text_range_field(field):
+            return [text_range.get(field) for text_range in text_ranges]
+
+        update_dates = process_datetimes(get_field('updateDate'))
+        creation_dates = process_datetimes(get_field('creationDate'))
+
+        data = {
+            "organization": [self.__organizaiton] * num_issues,
+            "project": [self.__project_key] * num_issues,
+            "current_analysis_key": get_analysis_keys(update_dates, self.__analysis_keys_dates),
+            "creation_analysis_key": get_analysis_keys(creation_dates, self.__analysis_keys_dates),
+            "issue_key": get_field('key'),
+            "type": get_field('type'),
+            "rule": get_field('rule'),
+            "severity": get_field('severity'),
+            "status": get_field('status'),
+            "resolution": get_field('resolution'),
+            "effort": get_durations_from_str(get_field('effort')),
+            "debt": get_durations_from_str(get_field('debt')),
+            "tags": [','.join(tags) if tags else None for tags in get_field('tags')],
+            "creation_date": creation_dates,
+            "update_date": update_dates,
+            "close_date": process_datetimes(get_field('closeDate')),
+            "message": get_field('message'),
+            "component": get_field('component'),
+            "start_line": get_text_range_field('startLine'),
+            "end_line": get_text_range_field('endLine'),
+            "start_offset": get_text_range_field('startOffset'),
+            "end_offset": get_text_range_field('endOffset'),
+            "hash": get_field('hash'),
+            "from_hotspot": [str(project_issue['fromHotspot']) if 'fromHotspot' in project_issue else None for project_issue in project_issues],
+        }
+
+        issues_df = pd.DataFrame(data=data, columns=SONAR_ISSUES_TYPE.keys())
+        return issues_df.astype({
             "effort": "Int64",
             "debt": "Int64",
             "start_line" : "Int64",
@@ -224,15 +416,83 @@ class Issues(SonarObject):
             "update_date" : "datetime64[ns]",
             "close_date" : "datetime64[ns]",
         })
-        old_issues_df = self.__get_old_issues_df()
-        if old_issues_df is not None:
-            new_issues_df = issues_df.merge(old_issues_df, how = 'outer' ,indicator=True).loc[lambda x : x['_merge']=='left_only'].drop(['_merge'], axis=1)
+
+    def _write_csv(self, project_issues):
+
+        # Issues are normalized in batches as they are fetched
+        project_issues = iter(project_issues)
+        issues_dfs = []
+        while True:
+            batch = list(islice(project_issues, NORMALIZE_BATCH_SIZE))
+            if not batch:
+                break
+            issues_dfs.append(self.__normalize_issues(batch))
+
+        if not issues_dfs:
+            print("\tNo issues queried.")
         else:
-            new_issues_df = issues_df
-            
-        print(f"\t{new_issues_df.shape[0]} new issues")
-        new_issues_df.to_csv(file_path, index=False, header=True, mode='w')
+            issues_df = pd.concat(issues_dfs, ignore_index=True)
+            self.__issues_df = issues_df
+            self.__write_issues_df(issues_df, self.__component_key, self.__file_name)
+
+            # Issues of the failed pages may be older than the written ones
+            if self.__component_key == self.__project_key and not self.__pages_failed:
+                self.__state.update(self.__project_key, LAST_ISSUE_UPDATE, issues_df['update_date'].max())
+
+        # Issues of the analyses are written, the analyses watermark can move past them
+        if self.__queried and self.__component_key == self.__project_key and self.__analysis_keys_dates:
+            self.__state.update(self.__project_key, LAST_ISSUE_ANALYSIS_DATE, pd.Series([date for _, date in self.__analysis_keys_dates]).max())
+
+        # A complete fetch of all issues resets the reconciliation period
+        if self.__full_fetch and not self.__truncated_params and not self.__pages_failed and self.__component_key == self.__project_key:
+            self.__state.update(self.__project_key, LAST_ISSUE_RECONCILIATION, datetime.utcnow())
+
+    def is_complete(self):
+        """Whether all issues of the component were fetched: they could be queried and no query hit the MAX_ISSUES_NUM cap."""
+        return self.__queried and not self.__truncated_params
+
+    def get_truncated_files(self, files):
+        """
+        Files with issues in the queries that hit the MAX_ISSUES_NUM cap,
+        found with the files facet of these queries. None if the facet does
+        not list all of them, e.g. when a query has issues in more than
+        MAX_FACET_VALUES files, or if the issues could not be queried at all.
+        files is a list of (file_key, file_name) as returned by Files.get_files.
+        """
+        if not self.__queried:
+            return None
+
+        paths = set()
+        for params in self.__truncated_params:
+            response_dict = self._call_api(dict(params, p=1, ps=1, facets='files'))
+            if response_dict is None:
+                return None
+            values = [value for facet in response_dict.get('facets', []) if facet['property'] == 'files' for value in facet['values']]
+            if len(values) >= MAX_FACET_VALUES or sum(value['count'] for value in values) < response_dict['total']:
+                return None
+            paths.update(value['val'] for value in values)
+
+        # Facet values are the paths of the files, keys <project_key>:<path>,
+        # older servers return the keys. Project keys may contain colons.
+        prefix = f"{self.__project_key}:"
+        return [file for file in files if file[0] in paths or (file[0].startswith(prefix) and file[0][len(prefix):] in paths)]
+
+    def write_component_issues(self, files):
+        """
+        Write the issues of every file of the project from the issues already
+        fetched for the whole project, grouped by their component.
+        files is a list of (file_key, file_name) as returned by Files.get_files.
+        """
+        if self.__issues_df is None:
+            return
+
+        component_issues = dict(tuple(self.__issues_df.groupby('component', sort=False)))
+        for file_key, file_name in files:
+            if file_key not in component_issues:
+                continue
+            print(f"\t{file_name} - {file_key}")
+            issues_df = component_issues[file_key].reset_index(drop=True)
+            self.__write_issues_df(issues_df, file_key, get_proper_file_name(file_name))
 
     def process_elements(self):
-        self._query_server()
-        self._write_csv()
+        self._write_csv(self._query_server())
@@ -1,52 +1,92 @@
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import pandas as pd
 import os, sys, csv
-from datetime import datetime
-from pathlib import Path
 
 from .sonar_object import SonarObject
+from .state import StateManifest, LAST_MEASURE_DATE
 from .route_config import RequestsConfig
-from .utils import get_proper_file_name, read_used_metrics
-
-def safe_cast(val, to_type, contain_comma=False, list_with_semicolon=False):
-    if to_type in ['INT', 'WORK_DUR']:
-        try:
-            return int(val)
-        except (ValueError, TypeError):
-            print("WARNING: exception casting value {0} to type {1}".format(str(val), to_type))
-            return None
-    elif to_type in ['FLOAT', 'PERCENT', 'RATING']:
-        try:
-            return float(val)
-        except (ValueError, TypeError):
-            print("WARNING: exception casting value {0} to type {1}".format(str(val), to_type))
-            return None
-    elif to_type == 'BOOL':
-        try:
-            return bool(val)
-        except (ValueError, TypeError):
-            print("WARNING: exception casting value {0} to type {1}".format(str(val), to_type))
-            return None
+from .utils import get_proper_file_name, read_used_metrics, millis_to_datetime
+
+# Maximum number of metrics api/measures/search_history accepts in one request
+METRICS_BATCH_SIZE = 15
+
+def bulk_cast(values, dtype, cast):
+    """
+    Cast values to a numpy array of dtype at once, value by value with cast
+    only if some values are invalid. Returns the array and the mask of
+    values that could not be cast.
+    """
+    try:
+        return np.array(values, dtype=dtype), np.zeros(len(values), dtype=bool)
+    except (ValueError, TypeError, OverflowError):
+        cast_values = np.zeros(len(values), dtype=dtype)
+        failed = np.zeros(len(values), dtype=bool)
+        for i, val in enumerate(values):
+            try:
+                cast_values[i] = cast(val)
+            except (ValueError, TypeError, OverflowError):
+                failed[i] = True
+        return cast_values, failed
+
+def cast_values(values, to_type, contain_comma=False, list_with_semicolon=False):
+    """
+    Cast the values of a metric column at once, None staying None: ints for
+    INT and WORK_DUR, floats for FLOAT, PERCENT and RATING, bools, dates or
+    ints for MILLISEC and strings otherwise. Returns the cast values and the
+    number of values that could not be cast.
+    """
+    num_rows = len(values)
+    present = np.array([val is not None for val in values], dtype=bool)
+    present_values = [val for val in values if val is not None]
+
+    if to_type in ['INT', 'WORK_DUR', 'FLOAT', 'PERCENT', 'RATING']:
+        if to_type in ['INT', 'WORK_DUR']:
+            numbers, failed = bulk_cast(present_values, 'int64', int)
+        else:
+            numbers, failed = bulk_cast(present_values, 'float64', float)
+        missing = ~present
+        missing[present] = failed
+
+        if to_type == 'INT':
+            all_numbers = np.zeros(num_rows, dtype='int64')
+            all_numbers[present] = numbers
+            return pd.arrays.IntegerArray(all_numbers, missing), int(failed.sum())
+
+        # Missing values turn ints to floats, a column without values stays of objects
+        if missing.all():
+            return [None] * num_rows, int(failed.sum())
+        if not missing.any():
+            return numbers, 0
+        all_numbers = np.full(num_rows, np.nan)
+        all_numbers[present] = numbers
+        all_numbers[missing] = np.nan
+        return all_numbers, int(failed.sum())
+
+    # Other types keep Python objects so that the column type is inferred as before
+    cast = np.full(num_rows, None, dtype=object)
+    num_failed = 0
+    if to_type == 'BOOL':
+        cast[present] = np.array(present_values, dtype=object).astype(bool)
     elif to_type == 'MILLISEC':
-        try:
-            if len(val) >= 12:
-                return datetime.fromtimestamp(int(val) / 1000)
-            else:
-                return int(val)
-        except (ValueError, TypeError):
-            print("WARNING: exception casting value {0} to type {1}".format(str(val), to_type))
-            return None
+        # Dates for timestamps, ints for durations
+        present_cast = []
+        for val in present_values:
+            try:
+                present_cast.append(millis_to_datetime(val) if len(val) >= 12 else int(val))
+            except (ValueError, TypeError):
+                present_cast.append(None)
+                num_failed += 1
+        cast[present] = present_cast
     else:
-        try:
-            value = str(val)
-            if contain_comma:
-                value = value.replace(',', ';')
-            if list_with_semicolon:
-                value = value.replace(';', ',')
-            return value
-        except (ValueError, TypeError):
-            print("ERROR: error casting to type {0}".format(to_type))
-            return None
+        strs = pd.Series(present_values, dtype=object).astype(str)
+        if contain_comma:
+            strs = strs.str.replace(',', ';', regex=False)
+        if list_with_semicolon:
+            strs = strs.str.replace(';', ',', regex=False)
+        cast[present] = strs.values
+    return cast.tolist(), num_failed
 
 def concat_measures(measures_1, measures_2):
     for measure_1, measure_2 in zip(measures_1, measures_2):
@@ -83,21 +123,25 @@ class Measures(SonarObject):
             min_ts_str = pd.Timestamp(self.__analysis_dates.min()).to_pydatetime().strftime(format = '%Y-%m-%d')
             self._params['from'] = min_ts_str
 
-    # Different implementation from superclass method at line
-    # meansures = concat_meansures(meansires, self._query_server)
-    def _query_server(self):
-        response_dict = self._call_api()
-        if response_dict is None:
-            return []
-        
-        measures = response_dict["measures"]
-        self.__total_num_measures = response_dict['paging']['total']
-
-        if self._more_elements():
-            self._params['p'] = self._params['p'] + 1
-            measures = concat_measures(measures, self._query_server())
+    # Different implementation from superclass method,
+    # histories of the same metrics are concatenated page by page
+    def _query_server(self, params=None):
+        measures = []
+        for response_dict in self._iter_pages(params=params):
+            if not measures:
+                measures = response_dict["measures"]
+            else:
+                measures = concat_measures(measures, response_dict["measures"])
         return measures
 
+    def __query_metrics(self, metrics):
+        """Measures of a batch of metrics, a batch the server rejects is split in halves."""
+        measures = self._query_server(dict(self._params, p=1, metrics=','.join(metrics)))
+        if measures or len(metrics) == 1:
+            return measures
+        middle = len(metrics) // 2
+        return self.__query_metrics(metrics[:middle]) + self.__query_metrics(metrics[middle:])
+
     def __extract_measures_value(self, measures, metrics_order_type, non_server_metrics):
 
         num_rows = len(self.__analysis_keys)
@@ -130,16 +174,15 @@ class Measures(SonarObject):
                             'file_complexity_distribution', 'ncloc_language_distribution']:
                     list_with_semicolon = True
 
-                values = list(map(lambda x: None if 'value' not in x else safe_cast(x['value'], metric_type, contain_comma, list_with_semicolon), history))
-                values.reverse()            
-                values = values[:num_rows]  # get only num_rows latest values
+                values = [x.get('value') for x in reversed(history[-num_rows:])] if num_rows > 0 else []
 
                 # Interpolate with None till num_rows
                 if len(values) < num_rows:
                     values = values + [None] * (num_rows - len(values))
 
-                if metric_type == "INT":
-                    values = pd.array(values, dtype=pd.Int64Dtype())
+                values, num_failed = cast_values(values, metric_type, contain_comma, list_with_semicolon)
+                if num_failed:
+                    print(f"WARNING: exception casting {num_failed} value(s) of metric {metric} to type {metric_type}")
 
             # There's 1 metric with name 'project', will interfered with the first 'project' column
             if metric == "project":
@@ -149,19 +192,15 @@ class Measures(SonarObject):
         return columns, data
 
     def _write_csv(self):
+        df = pd.DataFrame(data=self.__data, columns=self.__columns)
+        print(f"\t{df.shape[0]} new measures")
 
         # Condition: query measures data for component file in the project
-        if self.__project_key != self.__component_key:
-            output_path = Path(self._output_path).joinpath("measures").joinpath(get_proper_file_name(self.__project_key))
-        else:
-            output_path = Path(self._output_path).joinpath("measures")
+        component = self.__project_key != self.__component_key
+        self._sink.write("measures", df, self.__organization, self.__project_key, self.__file_name, component=component, append=True)
 
-        output_path.mkdir(parents=True, exist_ok=True)
-        file_path = output_path.joinpath(f"{self.__file_name}_staging.csv")
-
-        df = pd.DataFrame(data=self.__data, columns=self.__columns)
-        print(f"\t{df.shape[0]} new measures")
-        df.to_csv(file_path, index=False, header=True, mode='w')
+        if not component and len(self.__analysis_dates) > 0:
+            StateManifest.get_manifest(self._output_path).update(self.__project_key, LAST_MEASURE_DATE, self.__analysis_dates.max())
 
     def __metric_wise_search(self):
         all_metrics_order_type = read_used_metrics()
@@ -169,12 +208,16 @@ class Measures(SonarObject):
         non_server_metrics = all_metrics_set.difference(set(self.__server_metrics))
         new_server_metrics = set(self.__server_metrics).difference(all_metrics_set)
 
-        measures = []
+        batches = [self.__server_metrics[i:i + METRICS_BATCH_SIZE] for i in range(0, len(self.__server_metrics), METRICS_BATCH_SIZE)]
 
-        for i in range(0, len(self.__server_metrics), 10):
-            self._params['metrics'] = ','.join(self.__server_metrics[i:i + 10])
-            self._params['p'] = 1
-            measures = measures + self._query_server()
+        # Batches are fetched by up to page_workers threads, their measures kept in batch order
+        workers = min(self._route_config.page_workers, len(batches))
+        if workers <= 1:
+            batch_measures = [self.__query_metrics(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                batch_measures = list(executor.map(self.__query_metrics, batches))
+        measures = [measure for measures in batch_measures for measure in measures]
 
         # Adding non-server metrics
         for non_server_metric in non_server_metrics:
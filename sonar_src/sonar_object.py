@@ -1,49 +1,108 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import math
+
 from .route_config import RequestsConfig
+from .sinks import SinkConfig
 from .utils import identity
 
+def paging_total(response_dict):
+    return response_dict['paging']['total']
+
+def root_total(response_dict):
+    return response_dict['total']
+
 class SonarObject:
     def __init__(self, endpoint, params, output_path):
         self.__endpoint = endpoint
         self._params = params
         self._element_list = []
         self._total_num_elements = 0
+        # Pages _iter_pages could not fetch, they are skipped
+        self._failed_pages = 0
         self.__response = {}
 
         self._route_config = RequestsConfig()
-        self.__session = self._route_config.route_session()
+        self._session = self._route_config.route_session(endpoint)
         self._output_path = output_path
-    
-    def _call_api(self):
-        response = self._route_config.call_api_route(session=self.__session, endpoint=self.__endpoint, params=self._params)
-        if not self._route_config.check_invalid_status_code(response=response):
-            return None
-        return response.json()
+        self._sink = SinkConfig.get_sink(output_path)
 
-    def _query_server(self, key, format_function=identity):
-        response_dict = self._call_api()
+    def _call_api(self, params=None):
+        params = self._params if params is None else params
+        return self._route_config.get_json(session=self._session, endpoint=self.__endpoint, params=params)
+
+    def _iter_pages(self, total_function=paging_total, max_elements=None, params=None):
+        """
+        Yield the response of every page in page order, starting at params['p'].
+        The first page gives the total, the remaining pages are then fetched
+        by up to RequestsConfig.page_workers threads. Pages that cannot be
+        fetched are counted in _failed_pages, nothing more is fetched when
+        the first page fails.
+        """
+        params = self._params if params is None else params
+
+        response_dict = self._call_api(params)
         if response_dict is None:
+            self._failed_pages += 1
             return
-            
-        self._element_list = format_function(response_dict[key])
+        yield response_dict
 
-        if key in ["metrics", "rules"]:
-            self._total_num_elements = response_dict['total']
-        else:
-            self._total_num_elements = response_dict['paging']['total']
+        total = total_function(response_dict)
+        if max_elements is not None:
+            total = min(total, max_elements)
+        self._total_num_elements = total
 
-        if self._more_elements():
-            self._params['p'] = self._params['p'] + 1
-            self._element_list = self._element_list + self._query_server(key, format_function=format_function)
+        first_page = params['p']
+        last_page = math.ceil(total / params['ps'])
+        pages = range(first_page + 1, last_page + 1)
 
+        if self._route_config.page_workers <= 1 or len(pages) <= 1:
+            for page in pages:
+                params['p'] = page
+                response_dict = self._call_api(params)
+                if response_dict is None:
+                    self._failed_pages += 1
+                else:
+                    yield response_dict
+            return
+
+        # At most page_workers pages are in flight or waiting to be consumed
+        workers = self._route_config.page_workers
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = deque()
+            for page in pages:
+                futures.append(executor.submit(self._call_api, dict(params, p=page)))
+                if len(futures) < workers:
+                    continue
+                response_dict = futures.popleft().result()
+                if response_dict is None:
+                    self._failed_pages += 1
+                else:
+                    yield response_dict
+            while futures:
+                response_dict = futures.popleft().result()
+                if response_dict is None:
+                    self._failed_pages += 1
+                else:
+                    yield response_dict
+        params['p'] = last_page
+
+    def _iter_elements(self, key, format_function=identity):
+        """
+        Yield the elements under key page by page, only one page of the
+        response is kept in memory at a time.
+        """
+        total_function = root_total if key in ["metrics", "rules"] else paging_total
+
+        for response_dict in self._iter_pages(total_function):
+            yield from format_function(response_dict[key])
+
+    def _query_server(self, key, format_function=identity):
+        self._element_list = list(self._iter_elements(key, format_function))
         return self._element_list
-    
-    def _more_elements(self):
-        if self._params['p'] * self._params['ps'] < self._total_num_elements:
-            return True
-        return False
 
     def _write_csv(self):
         pass
 
     def process_elements(self):
-        pass
\ No newline at end of file
+        pass
@@ -1,6 +1,5 @@
 import pandas as pd
 from pathlib import Path
-import requests
 
 from .sonar_object import SonarObject
 from .route_config import RequestsConfig
@@ -29,11 +28,8 @@ class Projects(SonarObject):
 
         if projects:
             headers = list(self._element_list[0].keys())
-            output_path = Path(self._output_path).joinpath("projects")
-            output_path.mkdir(parents=True, exist_ok=True)
-            file_path = output_path.joinpath("projects.csv")
             df = pd.DataFrame(data=projects, columns=headers)
-            df.to_csv(file_path, index=False, header=True, mode='w')
+            self._sink.write("projects", df, self._organization, None, "projects", staging=False)
 
     def _query_repo_server(self):
         projects = [p for p in self._element_list]
@@ -41,14 +37,14 @@ class Projects(SonarObject):
         no_repo = []
         repos = []
         for project in projects:
-            r = self._route_config.call_api_route(session=self._SonarObject__session, endpoint=self._server + "api/navigation/component", params={
+            r = self._route_config.call_api_route(session=self._session, endpoint=self._server + "api/navigation/component", params={
                 'component': project['key'],
                 'organization': project['organization']
             })
             body = r.json()
             repoInfo = body.get('alm', None)
 
-            r = self._route_config.call_api_route(session=self._SonarObject__session, endpoint=self._server + "api/project_branches/list", params={
+            r = self._route_config.call_api_route(session=self._session, endpoint=self._server + "api/project_branches/list", params={
                 'project': project['key'],
                 'organization': project['organization']
             })
@@ -66,7 +62,9 @@ class Projects(SonarObject):
 
             else:
                 repo = f'https://github.com/{project["organization"]}/{project["key"]}'
-                if requests.get(f'{repo}/commit/{commit}').status_code == 200:
+                github_session = self._route_config.route_session(repo)
+                r = self._route_config.call_api_route(session=github_session, endpoint=f'{repo}/commit/{commit}', params=None)
+                if r.status_code == 200:
                     project['repo'] = repo
                     repos.append({'full_name': f"{project['organization']}/{project['key']}", 'url': repo, 'commit_hash': commit})
                     new_projects.append(project)
@@ -74,16 +72,18 @@ class Projects(SonarObject):
                     no_repo.append(project)
         self._element_list = new_projects
         import json
+        Path(self._output_path).mkdir(parents=True, exist_ok=True)
         with open(Path(self._output_path).joinpath("repos.json"), 'w') as f:
             json.dump(repos, f)
         file_number = 1
-        f = open(Path(self._output_path).joinpath(f"project_links{i}.txt"), 'w')
+        f = open(Path(self._output_path).joinpath(f"project_links{file_number}.txt"), 'w')
         for i in range(len(new_projects)):
-            f.write(f"https://sonarcloud.io/dashboard?id={new_projects[i]['key']}")
+            f.write(f"https://sonarcloud.io/dashboard?id={new_projects[i]['key']}\n")
             if i % 40 == 0 and i != 0:
                 f.close()
                 file_number += 1
-                f = open(Path(self._output_path).joinpath(f"project_links{i}.txt"), 'w')
+                f = open(Path(self._output_path).joinpath(f"project_links{file_number}.txt"), 'w')
+        f.close()
 
     def process_elements(self):
         self._query_server(key = "components")
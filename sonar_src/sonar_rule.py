@@ -22,6 +22,6 @@ class Rules(SonarObject):
         return rule_keys
 
     def get_server_rules(self):
-        self._query_server(key="rules", format_function=Rules.get_rule_keys)
+        self._element_list = Rules.get_rule_keys(self._iter_elements(key="rules"))
         return self._element_list
 
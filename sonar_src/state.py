@@ -0,0 +1,76 @@
+import json
+import threading
+from pathlib import Path
+
+import pandas as pd
+
+from .utils import write_json_atomic
+
+# Bump when the layout of the state manifest changes
+STATE_FORMAT_VERSION = 1
+
+# Watermarks recorded for each project
+LAST_ANALYSIS_DATE = "last_analysis_date"
+LAST_MEASURE_DATE = "last_measure_date"
+LAST_ISSUE_UPDATE = "last_issue_update"
+LAST_ISSUE_ANALYSIS_DATE = "last_issue_analysis_date"
+LAST_ISSUE_RECONCILIATION = "last_issue_reconciliation"
+
+class StateManifest:
+    """
+    Watermarks of the projects mined into an output path (dates of the
+    last analysis, measures and issue update written, of the last analysis
+    whose issues were written and of the last full issues fetch), kept in <output_path>/state.json so that incremental
+    runs do not read the archives back. A watermark only moves forward and
+    the manifest is rewritten atomically after each update.
+    """
+    __manifests = {}
+    __registry_lock = threading.Lock()
+
+    def __init__(self, output_path):
+        self.__file_path = Path(output_path).joinpath("state.json")
+        self.__lock = threading.Lock()
+        self.__projects = self.__load()
+
+    @classmethod
+    def get_manifest(cls, output_path):
+        """Manifest of output_path, shared by every project of the run."""
+        key = str(Path(output_path).resolve())
+        with cls.__registry_lock:
+            if key not in cls.__manifests:
+                cls.__manifests[key] = cls(output_path)
+            return cls.__manifests[key]
+
+    def __load(self):
+        if not self.__file_path.exists():
+            return {}
+        try:
+            with open(self.__file_path, 'r') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: {e} reading state manifest {self.__file_path}, archives will be read instead")
+            return {}
+
+        if manifest.get('format_version') != STATE_FORMAT_VERSION:
+            return {}
+        return manifest['projects']
+
+    def get(self, project_key, name):
+        """Watermark name of the project as a Timestamp, None if not recorded yet."""
+        with self.__lock:
+            value = self.__projects.get(project_key, {}).get(name)
+        return None if value is None else pd.Timestamp(value)
+
+    def update(self, project_key, name, value):
+        if value is None or pd.isna(value):
+            return
+        value = pd.Timestamp(value)
+
+        with self.__lock:
+            state = self.__projects.setdefault(project_key, {})
+            if name in state and pd.Timestamp(state[name]) >= value:
+                return
+            state[name] = value.isoformat()
+
+            self.__file_path.parent.mkdir(parents=True, exist_ok=True)
+            write_json_atomic(self.__file_path, {'format_version': STATE_FORMAT_VERSION, 'projects': self.__projects})
@@ -1,7 +1,14 @@
 from datetime import datetime, timedelta
-import sys, re, os
+from contextlib import contextmanager
+from functools import lru_cache
+import sys, re, os, io, json, tempfile, threading
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+
+SONAR_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S%z"
+
 def process_datetime(time_str):
     if time_str is None:
         return None
@@ -17,35 +24,62 @@ def process_datetime(time_str):
 
     return ts
 
-def get_duration_from_str(input_str):
-    if input_str is not None:
-        idx_min = input_str.find('min')
-        idx_h = input_str.find('h')
-        idx_d = input_str.find('d')
-
-        if idx_d != -1:
-            days = int(input_str[:idx_d])
-            if len(input_str) == idx_d + 1:
-                return 24 * 60 * days
-            return 24 * 60 * days + get_duration_from_str(input_str[idx_d + 1:])
-
-        if idx_h != -1:
-            hours = int(input_str[:idx_h])
-            if len(input_str) == idx_h + 1:
-                return 60 * hours
-            return 60 * hours + get_duration_from_str(input_str[idx_h + 1:])
-
-        if idx_min != -1:
-            minutes = int(input_str[:idx_min])
-            return minutes
-
-        print("ERROR: duration string '{0}' does not contain 'min', 'h' or 'd'.".format(input_str))
-        sys.exit(1)
+def process_datetimes(time_strs):
+    """
+    Vectorized process_datetime: parse a column of SonarQube timestamps
+    ('2020-01-31T10:00:00+0200') into UTC datetime64[ns] values.
+    Each distinct timestamp is parsed once, missing or invalid ones give NaT.
+    """
+    codes, uniques = pd.factorize(pd.Series(time_strs, dtype=object))
+    parsed = pd.to_datetime(pd.Series(uniques, dtype=object), format=SONAR_DATETIME_FORMAT, utc=True, errors='coerce')
+    parsed = parsed.dt.tz_localize(None).values
+
+    datetimes = np.full(len(codes), np.datetime64('NaT'), dtype='datetime64[ns]')
+    datetimes[codes >= 0] = parsed[codes[codes >= 0]]
+    return datetimes
+
+@lru_cache(maxsize=65536)
+def millis_to_datetime(millis):
+    # Local time, as datetime.fromtimestamp
+    return datetime.fromtimestamp(int(millis) / 1000)
+
+# SonarQube work durations, e.g. '1d2h30min', a day counting 24 hours
+DURATION_PATTERN = re.compile(r"\s*(?:(\d+)\s*d)?\s*(?:(\d+)\s*h)?\s*(?:(\d+)\s*min)?\s*")
+
+@lru_cache(maxsize=4096)
+def parse_duration(input_str):
+    """Minutes of a duration string, None if it is not a valid duration."""
+    match = DURATION_PATTERN.fullmatch(input_str)
+    if match is None or not any(match.groups()):
+        return None
+    days, hours, minutes = (int(group) if group else 0 for group in match.groups())
+    return 24 * 60 * days + 60 * hours + minutes
+
+def get_durations_from_str(input_strs):
+    """
+    Minutes of a column of duration strings, e.g. '1d2h30min', as an Int64
+    array. Invalid values become <NA> and are reported in one warning.
+    """
+    codes, uniques = pd.factorize(pd.Series(input_strs, dtype=object))
+    parsed = [parse_duration(str(value)) for value in uniques]
+
+    # Appended entry for missing values (code -1)
+    values = np.array([0 if duration is None else duration for duration in parsed] + [0], dtype="int64")
+    invalid = np.array([duration is None for duration in parsed] + [False])
+
+    invalid_count = int(invalid[codes].sum())
+    if invalid_count:
+        examples = [value for value, duration in zip(uniques, parsed) if duration is None][:3]
+        print(f"WARNING: {invalid_count} duration strings without 'min', 'h' or 'd' set to <NA>, e.g. {examples}")
+
+    return pd.arrays.IntegerArray(values[codes], invalid[codes] | (codes < 0))
 
 def get_proper_file_name(origin):
     p = re.compile("[^0-9a-z-_]")
     return p.sub('_', origin.lower())
 
+# Read once per run, the returned dict is shared and must not be modified
+@lru_cache(maxsize=None)
 def read_used_metrics():
 
     current_file_path = os.path.realpath(__file__)
@@ -71,5 +105,65 @@ def read_used_metrics():
         print("ERROR: Reading metrics file", e)
         sys.exit(1)
 
+# Read once at import, os.umask can only be read by setting it
+_umask = os.umask(0)
+os.umask(_umask)
+
+def set_file_mode(file_path):
+    """Make a file created by tempfile.mkstemp, which is owner-only, readable like the other output files."""
+    os.chmod(file_path, 0o644 & ~_umask)
+
+def write_json_atomic(file_path, obj):
+    """Write obj as JSON, readers see either the old or the new file."""
+    file_path = Path(file_path)
+    fd, tmp_path = tempfile.mkstemp(dir=file_path.parent, suffix=".tmp")
+    with os.fdopen(fd, 'w') as f:
+        json.dump(obj, f)
+    set_file_mode(tmp_path)
+    os.replace(tmp_path, file_path)
+
 def identity(p):
-    return p
\ No newline at end of file
+    return p
+
+_thread_output = threading.local()
+_output_lock = threading.Lock()
+
+class ThreadOutput:
+    """
+    sys.stdout replacement sending the prints of a thread to its own buffer
+    while buffered_output is active in that thread.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+
+    def write(self, text):
+        buffer = getattr(_thread_output, 'buffer', None)
+        if buffer is not None:
+            return buffer.write(text)
+        with _output_lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+@contextmanager
+def buffered_output():
+    """
+    Collect everything the current thread prints and print it as one block
+    at the end, so that concurrent projects do not interleave their output.
+    """
+    if not isinstance(sys.stdout, ThreadOutput):
+        sys.stdout = ThreadOutput(sys.stdout)
+
+    buffer = io.StringIO()
+    _thread_output.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        _thread_output.buffer = None
+        with _output_lock:
+            sys.stdout.stream.write(buffer.getvalue())
+            sys.stdout.stream.flush()
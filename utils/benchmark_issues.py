@@ -0,0 +1,93 @@
+# Times the normalization and writing of synthetic issues, without any server.
+# N issues shaped like api/issues/search ones are first normalized into the
+# issues frame, batch by batch, then fed to Issues._write_csv, which also
+# fingerprints them and writes them to a temporary output path.
+import argparse
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sonar_src.sonar_issue import Issues, NORMALIZE_BATCH_SIZE
+
+SEVERITIES = ["INFO", "MINOR", "MAJOR", "CRITICAL", "BLOCKER"]
+TYPES = ["CODE_SMELL", "BUG", "VULNERABILITY"]
+EFFORTS = ["5min", "1h", "1d2h30min", "2d"]
+BASE_DATE = datetime(2020, 1, 1)
+
+def make_issue(i, files, rules):
+    creation_date = BASE_DATE + timedelta(seconds=random.randint(0, 86400 * 700))
+    # Issues created by the first analysis share its timestamp
+    if random.random() < 0.3:
+        creation_date = BASE_DATE
+    update_date = creation_date + timedelta(seconds=random.randint(0, 86400 * 30))
+    issue = {
+        'key': f"ISSUE{i}",
+        'rule': random.choice(rules),
+        'severity': random.choice(SEVERITIES),
+        'type': random.choice(TYPES),
+        'component': random.choice(files),
+        'status': 'OPEN',
+        'message': f"message {i}",
+        'creationDate': creation_date.strftime('%Y-%m-%dT%H:%M:%S') + '+0200',
+        'updateDate': update_date.strftime('%Y-%m-%dT%H:%M:%S') + '-0130',
+        'tags': ['convention', 'pitfall'] if i % 3 else [],
+        'effort': random.choice(EFFORTS),
+        'debt': random.choice(EFFORTS),
+        'textRange': {'startLine': i % 50, 'endLine': i % 50 + 1, 'startOffset': 0, 'endOffset': 3},
+        'hash': f"hash{i}",
+        'fromHotspot': False,
+    }
+    if i % 7 == 0:
+        issue.pop('textRange')
+        issue.pop('effort')
+    if i % 11 == 0:
+        issue['closeDate'] = issue['updateDate']
+        issue['resolution'] = 'FIXED'
+    return issue
+
+def main(num_issues, num_files, seed=1):
+    random.seed(seed)
+    files = [f"project:src/File{i}.java" for i in range(num_files)]
+    rules = [f"java:S{i}" for i in range(60)]
+    issues = [make_issue(i, files, rules) for i in range(num_issues)]
+
+    # One analysis a week over the period of the issues
+    analysis_dates = np.array([BASE_DATE + timedelta(days=7 * i) for i in range(110)][::-1], dtype='datetime64[ns]')
+    analysis_keys = [f"ANALYSIS{i}" for i in range(len(analysis_dates))]
+
+    output_path = tempfile.mkdtemp()
+    try:
+        issues_object = Issues("http://localhost:9000/", "organization", output_path, "project", "project", "project", (analysis_keys, analysis_dates), rules)
+
+        start = time.perf_counter()
+        for i in range(0, num_issues, NORMALIZE_BATCH_SIZE):
+            issues_object._Issues__normalize_issues(issues[i:i + NORMALIZE_BATCH_SIZE])
+        normalize_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        issues_object._write_csv(iter(issues))
+        write_time = time.perf_counter() - start
+    finally:
+        shutil.rmtree(output_path, ignore_errors=True)
+
+    print(f"{num_issues} issues normalized in {normalize_time:.2f}s, normalized and written in {write_time:.2f}s")
+
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description="Benchmark of the normalization and writing of issues.")
+
+    ap.add_argument("-n", "--issues", type = int, default = 200000, help = "Number of synthetic issues.")
+    ap.add_argument("-f", "--files", type = int, default = 200, help = "Number of files the issues are spread over.")
+    ap.add_argument("--seed", type = int, default = 1, help = "Seed of the synthetic issues.")
+
+    args = vars(ap.parse_args())
+
+    main(args['issues'], args['files'], args['seed'])
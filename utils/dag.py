@@ -1,44 +1,70 @@
-# To be used for airflow
-from airflow import DAG
-from airflow.operators.bash_operator import BashOperator
-from airflow.operators.python_operator import PythonOperator
-
+# Mines an organization as a graph of stages, run in process: the metrics and
+# rules catalogs and the project list, then for each project its analyses,
+# its measures and issues at the same time, its component-wise issues, and
+# the merge of its staging files as soon as the project is done.
+import argparse
 import sys
-repo_dir = "/mnt/sonar_miner"
-sys.path.append(repo_dir)
-
-from sonar_src import fetch_sonar_data
-from merge_stage_archive import main
-
-from datetime import datetime, timedelta, date
-
-default_args = {
-    'owner': 'hung',
-    'depends_on_past': False,
-    'start_date': datetime(2020,10,3),
-    'email': ['hung.nguyen@tuni.fi'],
-    'email_on_failure': True,
-    'retries': 1,
-    'retry_delay': timedelta(minutes=5),
-}
-
-dag = DAG('sonar_miner', default_args = default_args, schedule_interval = '0 0 * * *')
-
-t1 = PythonOperator(
-    task_id = 'fetch_sonarqube_data',
-    provide_context=False,
-    python_callable= fetch_sonar_data,
-    op_args=[f'{repo_dir}/sonar_data', 'apache', 'https://sonarcloud.io/'],
-    dag = dag
-)
-
-
-t2 = PythonOperator(
-    task_id = "merge_stage_archive",
-    provide_context=False,
-    python_callable= main,
-    op_args=[f"{repo_dir}/sonar_data"],
-    dag = dag
-)
-
-t1 >> t2
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from sonar_src import schedule_organization_sonar_data
+from sonar_src.route_config import RequestsConfig
+from sonar_src.sonar_issue import IssuesConfig
+from sonar_src.utils import get_proper_file_name
+from merge_stage_archive import merge_all, get_archive_files, SONAR_ANALYSES_DTYPE, SONAR_MEASURES_DTYPE, SONAR_ISSUES_DTYPE
+
+SONARCLOUD = "https://sonarcloud.io/"
+
+def merge_project(sonar_data_dir, project_key, compaction="auto", memory_budget=None):
+    """Merge the staging files of one project, component-wise ones included."""
+    sonar_data_dir = Path(sonar_data_dir)
+    file_name = get_proper_file_name(project_key)
+
+    archives = []
+    for stage, dtype in [("analyses", SONAR_ANALYSES_DTYPE), ("measures", SONAR_MEASURES_DTYPE), ("issues", SONAR_ISSUES_DTYPE)]:
+        stage_dir = sonar_data_dir.joinpath(stage)
+        archives.append((stage_dir.joinpath(f"{file_name}.csv"), dtype))
+        archives += [(archive_file, dtype) for archive_file in get_archive_files(stage_dir.joinpath(file_name))]
+
+    failed = merge_all(archives, compaction, memory_budget=memory_budget)
+    if failed:
+        raise RuntimeError(f"{failed} file(s) of project {project_key} failed to merge")
+
+def main(sonar_data_dir, organization="apache", server=SONARCLOUD, component_wise=False, workers=1, resume=False, compaction="auto", memory_budget=None):
+    return schedule_organization_sonar_data(
+        sonar_data_dir,
+        organization,
+        server,
+        component_wise,
+        workers,
+        resume=resume,
+        merge_project=lambda project_key: merge_project(sonar_data_dir, project_key, compaction, memory_budget)
+    )
+
+if __name__ == "__main__":
+
+    ap = argparse.ArgumentParser(description="Script to mine an organization and merge the data of each project as soon as it is mined.")
+
+    ap.add_argument("-p", "--output-path", default = "./sonar_data", help = "Path to output file directory.")
+    ap.add_argument("-s", "--server", default = SONARCLOUD, help = "Sonarqube Server.")
+    ap.add_argument("-o", "--organization", default = "apache", help = "Sonarqube organization.")
+    ap.add_argument("-c", "--component-wise", default = False, action = "store_true", help = "Whether to fetch issues data for all components of project.")
+    ap.add_argument("-w", "--workers", type = int, default = 4, help = "Number of stages run at the same time, across projects.")
+    ap.add_argument("--page-workers", type = int, default = 1, help = "Number of pages, or batches of measure metrics, fetched concurrently once the total number of elements is known.")
+    ap.add_argument("--rate-limit", type = float, default = 10.0, help = "Maximum number of requests per second sent to one server.")
+    ap.add_argument("--incremental", default = False, action = "store_true", help = "Fetch only the issues updated since the last run.")
+    ap.add_argument("--resume", default = False, action = "store_true", help = "Resume the last run, skipping the projects and stages it completed.")
+    ap.add_argument("--compaction", default = "auto", choices = ["auto", "force", "skip"], help = "Fold segments into the archives when over the thresholds (auto), always (force) or never (skip).")
+    ap.add_argument("--memory-budget", type = int, default = 1024, help = "Size in MB over which an archive is deduplicated in chunks.")
+
+    args = vars(ap.parse_args())
+    if args['memory_budget'] <= 0:
+        ap.error("--memory-budget must be a positive number of MB")
+
+    server = args['server'] if args['server'].endswith("/") else args['server'] + "/"
+    RequestsConfig.configure(page_workers=args['page_workers'], pool_size=max(10, args['workers'] * args['page_workers']), rate_limit=args['rate_limit'])
+    IssuesConfig.configure(incremental=args['incremental'])
+
+    failed = main(args['output_path'], args['organization'], server, args['component_wise'], args['workers'], args['resume'], args['compaction'], args['memory_budget'] * 1024 * 1024)
+    sys.exit(1 if failed else 0)
@@ -1,8 +1,25 @@
 import pandas as pd
 from pathlib import Path
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import math
+import os
+import shutil
+import uuid
 import sys
 import argparse
 
+# Each merge turns a staging file into an immutable segment <file>.seg-<utc ts>-<id>.csv.
+# Segments are folded into the <file>.csv archive by the compaction once there
+# are more than MAX_SEGMENTS of them or they weigh more than MAX_SEGMENTS_RATIO
+# of the archive. Keep in sync with sonar_src/sinks.py.
+SEGMENT_INFIX = ".seg-"
+MAX_SEGMENTS = 8
+MAX_SEGMENTS_RATIO = 0.5
+
+# Rows read at once when an archive is deduplicated in chunks
+CHUNK_ROWS = 100000
+
 SONAR_ANALYSES_DTYPE = {
     "organization" : "object",
     "project" : "object", 
@@ -141,28 +158,151 @@ SONAR_ISSUES_DTYPE = {
     "close_date" :  "object"
 }
 
-def merge(file_directory, DTYPE):
+def get_segments(archive_file):
+    """Segments of an archive, oldest first."""
+    return sorted(archive_file.parent.glob(f"{archive_file.stem}{SEGMENT_INFIX}*.csv"))
+
+def read_archive(archive_file, DTYPE):
+    """
+    Full table of an archive: the archive and its segments not yet compacted,
+    without the rows repeated between them. None if there is neither.
+    """
+    files = [file for file in [archive_file] + get_segments(archive_file) if file.exists()]
+    if not files:
+        return None
+    df = pd.concat([pd.read_csv(file.resolve(), dtype=DTYPE, header=0) for file in files], ignore_index=True)
+    # Newest rows last, as in compact
+    return df.drop_duplicates(keep='last', ignore_index=True)
+
+def append_segment(staging_file, archive_file):
+    segment_name = f"{archive_file.stem}{SEGMENT_INFIX}{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}.csv"
+    staging_file.rename(archive_file.parent.joinpath(segment_name))
+
+def needs_compaction(archive_file, segments):
+    if len(segments) > MAX_SEGMENTS:
+        return True
+    archive_size = archive_file.stat().st_size if archive_file.exists() else 0
+    return sum(segment.stat().st_size for segment in segments) > MAX_SEGMENTS_RATIO * archive_size
 
+def get_archive_file(file):
+    """Archive of a staging file or of a segment."""
+    name = file.name
+    if name.endswith("_staging.csv"):
+        return file.with_name(name[:-len("_staging.csv")] + ".csv")
+    return file.with_name(name[:name.index(SEGMENT_INFIX)] + ".csv")
+
+def get_archive_files(file_directory):
+    """Archives with staging files or segments, subdirectories included."""
     if not file_directory.exists():
-        return
+        return []
+    files = list(file_directory.rglob("*_staging.csv")) + list(file_directory.rglob(f"*{SEGMENT_INFIX}*.csv"))
+    return sorted({get_archive_file(file) for file in files})
+
+def compact_in_memory(files, DTYPE, tmp_file):
+    df = pd.concat([pd.read_csv(file.resolve(), dtype=DTYPE, header=0) for file in files], ignore_index=True)
+    df.drop_duplicates(inplace=True)
+    df.to_csv(path_or_buf=tmp_file, index=False, header=True)
 
-    for file in file_directory.glob("*_staging.csv"):
-        archive_file = Path(str(file).replace("_staging", ""))
-        if archive_file.exists():
+def compact_in_chunks(files, DTYPE, tmp_file, num_buckets):
+    """
+    Deduplicate files larger than the memory budget: rows are spread over
+    num_buckets bucket files by a hash of their text columns, so that equal
+    rows end in the same bucket, then each bucket is deduplicated on its own.
+    Rows come out grouped by bucket instead of in the archive order.
+    """
+    bucket_dir = tmp_file.with_name(f"{tmp_file.name}.buckets")
+    shutil.rmtree(bucket_dir, ignore_errors=True)
+    bucket_dir.mkdir()
 
-            old_df = pd.read_csv(archive_file.resolve(), dtype=DTYPE, header=0)
-            new_df = pd.read_csv(file.resolve(), dtype = DTYPE, header = 0)
+    # Files may have different columns, e.g. measures of new metrics
+    columns = []
+    for file in files:
+        columns += [column for column in pd.read_csv(file.resolve(), nrows=0).columns if column not in columns]
+    hash_columns = [column for column in columns if DTYPE.get(column) == "object"]
 
-            df = pd.concat([new_df, old_df], ignore_index = True)
+    try:
+        bucket_files = [bucket_dir.joinpath(f"bucket-{i}.csv") for i in range(num_buckets)]
+        for file in files:
+            for chunk in pd.read_csv(file.resolve(), dtype=DTYPE, header=0, chunksize=CHUNK_ROWS):
+                chunk = chunk.reindex(columns=columns)
+                buckets = pd.util.hash_pandas_object(chunk[hash_columns].astype("string"), index=False) % num_buckets
+                for bucket, bucket_df in chunk.groupby(buckets.values, sort=False):
+                    bucket_file = bucket_files[bucket]
+                    bucket_df.to_csv(bucket_file, index=False, header=not bucket_file.exists(), mode='a')
+
+        header = True
+        for bucket_file in bucket_files:
+            if not bucket_file.exists():
+                continue
+            df = pd.read_csv(bucket_file, dtype=DTYPE, header=0)
             df.drop_duplicates(inplace=True)
-            
-            df.to_csv(path_or_buf= archive_file, index=False, header=True)
-            
-            file.unlink()
-        else:
-            file.rename(archive_file)
+            df.to_csv(path_or_buf=tmp_file, index=False, header=header, mode='w' if header else 'a')
+            header = False
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
 
-def main(sonar_data_dir):
+def compact(archive_file, DTYPE, memory_budget=None):
+    segments = get_segments(archive_file)
+    if not segments:
+        return
+
+    # Newest rows first, as drop_duplicates keeps the first occurrence
+    files = segments[::-1]
+    if archive_file.exists():
+        files.append(archive_file)
+
+    # Readers never see a half written archive, nor rows both in the archive and a segment
+    tmp_file = archive_file.with_name(f"{archive_file.name}.tmp")
+    size = sum(file.stat().st_size for file in files)
+    # No budget when memory_budget is None or not positive
+    if memory_budget is not None and 0 < memory_budget < size:
+        compact_in_chunks(files, DTYPE, tmp_file, math.ceil(size / memory_budget))
+    else:
+        compact_in_memory(files, DTYPE, tmp_file)
+    os.replace(tmp_file, archive_file)
+    for segment in segments:
+        segment.unlink()
+
+def merge_archive(archive_file, DTYPE, compaction="auto", memory_budget=None):
+    """
+    Append the staging file of archive_file as a new segment, then compact
+    the archive according to compaction: auto (over the thresholds),
+    force or skip.
+    """
+    try:
+        staging_file = archive_file.with_name(f"{archive_file.stem}_staging.csv")
+        if staging_file.exists():
+            if archive_file.exists() or get_segments(archive_file):
+                append_segment(staging_file, archive_file)
+            else:
+                staging_file.rename(archive_file)
+
+        if compaction == "skip":
+            return True
+
+        segments = get_segments(archive_file)
+        if segments and (compaction == "force" or needs_compaction(archive_file, segments)):
+            print(f"Compacting {len(segments)} segments into {archive_file}")
+            compact(archive_file, DTYPE, memory_budget)
+        return True
+    except Exception as e:
+        print(f"ERROR: {e!r} while merging {archive_file}")
+        return False
+
+def merge(file_directory, DTYPE, compaction="auto", workers=1, memory_budget=None):
+    return merge_all([(archive_file, DTYPE) for archive_file in get_archive_files(file_directory)], compaction, workers, memory_budget)
+
+def merge_all(archives, compaction="auto", workers=1, memory_budget=None):
+    """Merge the (archive_file, DTYPE) archives on up to workers processes, return the number of failures."""
+    if workers <= 1:
+        results = [merge_archive(archive_file, DTYPE, compaction, memory_budget) for archive_file, DTYPE in archives]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(merge_archive, archive_file, DTYPE, compaction, memory_budget) for archive_file, DTYPE in archives]
+            results = [future.result() for future in futures]
+    return results.count(False)
+
+def main(sonar_data_dir, compaction="auto", workers=1, memory_budget=None):
 
     dirs = []
     dtype_dicts = []
@@ -177,16 +317,28 @@ def main(sonar_data_dir):
         dirs +=  [sonar_analyses_dir, sonar_measures_dir, sonar_issues_dir]
         dtype_dicts +=  [SONAR_ANALYSES_DTYPE, SONAR_MEASURES_DTYPE, SONAR_ISSUES_DTYPE]
 
+    # Files of all directories share the same pool
+    archives = []
     for dir,dtype in zip(dirs, dtype_dicts):
-        print(f"Merging files in directory {dir.resolve()}")
-        merge(dir, dtype)
+        dir_archives = get_archive_files(dir)
+        print(f"Merging {len(dir_archives)} files in directory {dir.resolve()}")
+        archives += [(archive_file, dtype) for archive_file in dir_archives]
+
+    failed = merge_all(archives, compaction, workers, memory_budget)
+    if failed:
+        print(f"{failed} file(s) failed to merge")
 
 if __name__ == "__main__":
     
     ap = argparse.ArgumentParser(description="Script to merge staging and archive files.")
 
     ap.add_argument("-s", "--sonar", default = "./sonarcloud_data/data", help = "Path to Sonarqube data directory.")
+    ap.add_argument("--compaction", default = "auto", choices = ["auto", "force", "skip"], help = "Fold segments into the archives when over the thresholds (auto), always (force) or never (skip).")
+    ap.add_argument("-w", "--workers", type = int, default = os.cpu_count(), help = "Number of files merged at the same time.")
+    ap.add_argument("--memory-budget", type = int, default = 1024, help = "Size in MB over which an archive is deduplicated in chunks.")
 
     args = vars(ap.parse_args())
+    if args['memory_budget'] <= 0:
+        ap.error("--memory-budget must be a positive number of MB")
 
-    main(args['sonar'])
\ No newline at end of file
+    main(args['sonar'], args['compaction'], args['workers'], args['memory_budget'] * 1024 * 1024)
\ No newline at end of file